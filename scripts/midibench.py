@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+"""
+Time the read, write and conversion hot paths over synthetic patterns and print the results as JSON.
+"""
+import argparse
+import json
+import sys
+
+from midi import benchmark
+
+parser = argparse.ArgumentParser(description=__doc__.strip())
+for key in sorted(benchmark.DEFAULTS):
+    value = benchmark.DEFAULTS[key]
+    parser.add_argument("--" + key, type=type(value), default=value)
+parser.add_argument("-b", "--benchmark", dest="names", action="append",
+                    help="benchmark to run, may be repeated. One of: " + ", ".join(name for name, function in benchmark.BENCHMARKS))
+parser.add_argument("-o", "--output", help="file to write results to instead of stdout")
+args = vars(parser.parse_args())
+output = args.pop("output")
+
+results = benchmark.run(**args)
+if output:
+    with open(output, "w") as outfile:
+        json.dump(results, outfile, indent=2, sort_keys=True)
+else:
+    json.dump(results, sys.stdout, indent=2, sort_keys=True)
+    print
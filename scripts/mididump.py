@@ -2,13 +2,38 @@
 """
 Print a description of a MIDI file.
 """
+import argparse
+import json
 import midi
 import sys
 
-if len(sys.argv) != 2:
-    print "Usage: {0} <midifile>".format(sys.argv[0])
-    sys.exit(2)
+parser = argparse.ArgumentParser(description=__doc__.strip())
+parser.add_argument("midifiles", metavar="midifile", nargs="+")
+parser.add_argument("-j", "--workers", type=int, default=1,
+                    help="number of processes to load files with. 0 for one per cpu")
+parser.add_argument("--stats", action="store_true",
+                    help="print parser statistics as JSON instead of the pattern")
+args = parser.parse_args()
 
-midifile = sys.argv[1]
-pattern = midi.read_midifile(midifile)
-print repr(pattern)
+def describe(pattern, stats):
+    if args.stats:
+        return json.dumps(stats.as_dict(), indent=2, sort_keys=True)
+    return repr(pattern)
+
+if len(args.midifiles)==1 and args.workers==1:
+    stats = midi.ParseStats() if args.stats else None
+    pattern = midi.read_midifile(args.midifiles[0], stats=stats)
+    print describe(pattern, stats)
+    sys.exit(0)
+
+status = 0
+for result in midi.read_midifiles(args.midifiles, workers=args.workers or None, stats=args.stats):
+    print "{0}:".format(result.path)
+    for message in result.warnings:
+        print >> sys.stderr, "{0}: warning: {1}".format(result.path, message)
+    if result.error is not None:
+        print >> sys.stderr, "{0}: error: {1}".format(result.path, result.error)
+        status = 1
+    else:
+        print describe(result.pattern, result.stats)
+sys.exit(status)
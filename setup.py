@@ -1,7 +1,10 @@
 #!/usr/bin/env python
 
 from setuptools import setup
+import json
+import setuptools
 import setuptools.command.install
+import sys
 
 __base__={
     'name': 'midi',
@@ -13,10 +16,10 @@ __base__={
     'package_dir': {
         'midi': 'src'
         },
-    'py_modules': ['midi.__init__', 'midi.containers', 'midi.events', 'midi.util', 'midi.fileio', 'midi.constants'],
+    'py_modules': ['midi.__init__', 'midi.containers', 'midi.events', 'midi.util', 'midi.fileio', 'midi.constants', 'midi.tables', 'midi.packed', 'midi.parallel', 'midi.sequencer', 'midi.transforms', 'midi.benchmark'],
     'ext_modules': [],
     'ext_package': '',
-    'scripts': ['scripts/mididump.py']
+    'scripts': ['scripts/mididump.py', 'scripts/midibench.py']
 }
 
 # this kludge ensures we run the build_ext first before anything else
@@ -27,6 +30,41 @@ class Install_Command_build_ext_first(setuptools.command.install.install):
         return setuptools.command.install.install.run(self)
 
 
+class Benchmark_Command(setuptools.Command):
+    description = "run the benchmark suite and print the results as JSON"
+    user_options = [
+        ('notes=', None, 'notes per track'),
+        ('tracks=', None, 'number of tracks'),
+        ('repeat=', None, 'runs per benchmark, the fastest is reported'),
+        ('output=', 'o', 'file to write results to instead of stdout')
+    ]
+
+    def initialize_options(self):
+        self.notes = None
+        self.tracks = None
+        self.repeat = None
+        self.output = None
+
+    def finalize_options(self):
+        for option in ('notes', 'tracks', 'repeat'):
+            if getattr(self, option) is not None:
+                setattr(self, option, int(getattr(self, option)))
+
+    def run(self):
+        self.run_command("build_py")
+        sys.path.insert(0, self.get_finalized_command("build_py").build_lib)
+        from midi import benchmark
+        params = dict((option, getattr(self, option)) for option in ('notes', 'tracks', 'repeat') if getattr(self, option) is not None)
+        results = benchmark.run(**params)
+        if self.output:
+            with open(self.output, "w") as outfile:
+                json.dump(results, outfile, indent=2, sort_keys=True)
+        else:
+            print(json.dumps(results, indent=2, sort_keys=True))
+
+__base__['cmdclass'] = {'bench': Benchmark_Command}
+
+
 if __name__ == "__main__":
     setup(**__base__)
 
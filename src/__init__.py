@@ -3,3 +3,8 @@ from events import *
 from struct import unpack, pack
 from util import *
 from fileio import *
+from tables import *
+from packed import *
+from parallel import *
+from sequencer import *
+from transforms import *
@@ -0,0 +1,205 @@
+"""
+Benchmarks of the read, write and conversion hot paths over synthetic patterns. Each benchmark runs in its own
+process so that peak memory can be attributed to it. See scripts/midibench.py.
+"""
+
+from StringIO import StringIO
+
+import copy
+import multiprocessing
+import random
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from containers import Pattern, Track
+from events import *
+from fileio import read_midifile, write_midifile
+
+DEFAULTS = {
+    "notes": 10000,
+    "tracks": 4,
+    "tempos": 16,
+    "overlap": 0.25,
+    "sysex": 0.01,
+    "meta": 0.01,
+    "resolution": 480,
+    "repeat": 3,
+    "seed": 0
+}
+
+
+def generate_pattern(notes=10000, tracks=4, tempos=16, overlap=0.25, sysex=0.01, meta=0.01, resolution=480, seed=0):
+    """
+    :param notes: notes per track
+    :param tracks: number of tracks
+    :param tempos: tempo changes in the first track
+    :param overlap: fraction of notes that sound past the start of following notes
+    :param sysex: fraction of notes followed by a sysex event
+    :param meta: fraction of notes followed by a text meta event
+    :param resolution: pattern resolution
+    :param seed: random seed
+    :return: Pattern
+    """
+    rand = random.Random(seed)
+    pattern = Pattern(resolution=resolution, format=1)
+    for index in xrange(tracks):
+        events = [TrackNameEvent(offset=0, text="track %d" % index)]
+        offset = 0
+        for note in xrange(notes):
+            step = rand.randint(0, resolution//4)
+            duration = rand.randint(resolution, resolution*4) if rand.random()<overlap else rand.randint(1, max(step, 1))
+            events.append(NoteOnEvent(offset=offset, channel=index%16, pitch=rand.randint(36, 84),
+                                      velocity=rand.randint(1, 127), duration=duration))
+            if rand.random()<sysex:
+                events.append(SysexEvent(offset=offset, data=[0x7E, 0x7F, 0x09, 0x01]))
+            if rand.random()<meta:
+                events.append(MarkerEvent(offset=offset, text="marker %d" % note))
+            offset += step
+        if index==0:
+            for tempo in xrange(tempos):
+                event = SetTempoEvent(offset=offset*tempo//max(tempos, 1))
+                event.bpm = rand.randint(60, 180)
+                events.append(event)
+            events.sort(key=lambda e: e.offset)
+        pattern.append(Track(events))
+    return pattern
+
+
+def bench_read(pattern, repeat):
+    buf = StringIO()
+    write_midifile(buf, pattern)
+    data = buf.getvalue()
+    return _best(lambda: read_midifile(StringIO(data)), repeat), _count(pattern)
+
+
+def bench_write(pattern, repeat):
+    return _best(lambda: write_midifile(StringIO(), pattern), repeat), _count(pattern)
+
+
+def bench_insert_event(pattern, repeat):
+    events = [event for track in pattern for event in track]
+    def _insert():
+        track = Track()
+        for event in events:
+            track.insert_event(event)
+    return _best(_insert, repeat), len(events)
+
+
+def bench_get_tick_converter(pattern, repeat):
+    calls = 100
+    def _convert():
+        for index in xrange(calls):
+            pattern.get_tick_converter()
+    return _best(_convert, repeat), calls*_count(pattern)
+
+
+def bench_offset_to_seconds(pattern, repeat):
+    converter = pattern.get_tick_converter()
+    offsets = [event.offset for track in pattern for event in track]
+    def _convert():
+        for offset in offsets:
+            converter.offset_to_seconds(offset)
+    return _best(_convert, repeat), len(offsets)
+
+
+def bench_deepcopy(pattern, repeat):
+    return _best(lambda: copy.deepcopy(pattern), repeat), _count(pattern)
+
+
+def bench_clone(pattern, repeat):
+    return _best(pattern.clone, repeat), _count(pattern)
+
+
+def bench_view(pattern, repeat):
+    track = max(pattern, key=len)
+    page = 100
+    starts = range(0, len(track)-page, max((len(track)-page)//100, 1))
+    def _page():
+        for start in starts:
+            for event in track.view(start, start+page):
+                pass
+    return _best(_page, repeat), len(starts)*page
+
+
+BENCHMARKS = (
+    ("read_midifile", bench_read),
+    ("write_midifile", bench_write),
+    ("Track.insert_event", bench_insert_event),
+    ("Pattern.get_tick_converter", bench_get_tick_converter),
+    ("TickConverter.offset_to_seconds", bench_offset_to_seconds),
+    ("deepcopy", bench_deepcopy),
+    ("Pattern.clone", bench_clone),
+    ("TrackView", bench_view)
+)
+
+
+def run(names=None, **params):
+    """
+    runs benchmarks, each in a child process
+    :param names: names of benchmarks to run or None for all of BENCHMARKS
+    :param params: overrides of DEFAULTS
+    :return: dict of the parameters used and a result per benchmark suitable for JSON
+    """
+    params = dict(DEFAULTS, **params)
+    results = []
+    for name, function in BENCHMARKS:
+        if names is None or name in names:
+            queue = multiprocessing.Queue()
+            process = multiprocessing.Process(target=_run_one, args=(queue, function, params))
+            process.start()
+            result = queue.get()
+            process.join()
+            result["name"] = name
+            results.append(result)
+    return {"params": params, "results": results}
+
+
+def _run_one(queue, function, params):
+    """
+    child process side of run
+    """
+    try:
+        pattern = generate_pattern(**dict((key, params[key]) for key in
+            ("notes", "tracks", "tempos", "overlap", "sysex", "meta", "resolution", "seed")))
+        rss = _peak_rss()
+        seconds, events = function(pattern, params["repeat"])
+        peak = _peak_rss()
+        queue.put({
+            "seconds": seconds,
+            "events": events,
+            "events_per_sec": events/seconds if seconds>0 else None,
+            "peak_rss_kb": peak,
+            "peak_rss_delta_kb": peak-rss if peak is not None else None
+        })
+    except Exception as exception:
+        queue.put({"error": "%s: %s" % (exception.__class__.__name__, exception)})
+
+
+def _best(function, repeat):
+    """
+    :return: fastest of repeat runs of function in seconds
+    """
+    best = None
+    for index in xrange(max(repeat, 1)):
+        start = time.time()
+        function()
+        elapsed = time.time()-start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _peak_rss():
+    """
+    :return: peak resident set size of this process in kilobytes or None where unavailable
+    """
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _count(pattern):
+    return sum(len(track) for track in pattern)
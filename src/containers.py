@@ -1,15 +1,65 @@
 from __future__ import division
 
+from array import array
 from pprint import pformat
 
 import bisect
+import heapq
+
+import itertools
 
 import math
+import weakref
 
 import events
 import util
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# results of nearest_quantized_duration by (resolution, duration)
+_quantized_durations = {}
+_QUANTIZED_DURATIONS_MAX = 1<<16
+
+
+def nearest_quantized_duration(resolution, duration):
+    """
+    memoized per (resolution, duration)
+    :param resolution: PPQ
+    :param duration: length in PPQs to quantize
+    :return:
+    """
+    key=(resolution, duration)
+    result=_quantized_durations.get(key)
+    if result is None:
+        if len(_quantized_durations)>=_QUANTIZED_DURATIONS_MAX:
+            _quantized_durations.clear()
+        result=_quantized_durations[key]=_nearest_quantized_duration(resolution, duration)
+    return result
+
+
+def _nearest_quantized_duration(resolution, duration):
+    if duration<=1:
+        return 1
+    power=int(math.floor(math.log(duration/resolution, 2)))
+    # if we are within a single quarter then get real granular.  beyond that we are going to assume quantizing
+    # to the nearest ratios of a quarter below.
+    if power<0:
+        ratios=((pow(2, ratio)*multiple) for ratio in range(power, power+2) for multiple in (2/3, 3/4, 1))
+    else:
+        ratios=(duration//resolution+ratio for ratio in (0, 1/4, 1/3, 1/2, 2/3, 3/4, 1))
+    quantized=[int(resolution*ratio) for ratio in ratios]
+    for index in range(1, len(quantized)):
+        if duration<=quantized[index]:
+            return quantized[index] if quantized[index]-duration<=duration-quantized[index-1] else quantized[index-1]
+    return quantized[-1]
+
+
 class Pattern(list):
+    _tempo_cache = None
+
     # noinspection PyDefaultArgument
     def __init__(self, resolution=220, format=1, tracks=[]):
         self.format = format
@@ -21,45 +71,108 @@ class Pattern(list):
         return max([track.duration for track in self])
     duration=property(get_duration)
 
+    def invalidate(self):
+        """
+        invalidates every track, see Track.invalidate
+        """
+        for track in self:
+            track.invalidate()
+
     def get_tick_converter(self):
         """
-        creates a TickConverter instance from this guy. Only valid while tempo state of this pattern does not change
+        gets a TickConverter for this guy. The converter is cached and only rebuilt once a SetTempoEvent has been
+        added, removed or modified, or the tracks or resolution have changed. A converter that has been
+        handed out is a snapshot and does not follow later changes.
         :return: TickConverter
         """
+        tracks = list(self)
+        revisions = tuple(track._tempo_revision for track in tracks)
+        cache = self._tempo_cache
+        # the tracks are referred to weakly so that the cache does not keep released or removed tracks alive
+        if cache is not None and cache[0]==self.resolution and cache[2]==revisions and \
+                all(ref() is track for ref, track in zip(cache[1], tracks)):
+            if cache[4]==tuple((event.offset, event.mpqn) for event in cache[3]):
+                return cache[5]
         tempos = []
-        for track in self:
-            tempos.extend(filter(lambda e: isinstance(e, events.SetTempoEvent), track))
-        return TickConverter(tempos, self.resolution)
+        for track in tracks:
+            tempos.extend(track.events_of(events.SetTempoEvent))
+        converter = TickConverter(tempos, self.resolution)
+        self._tempo_cache = (self.resolution, tuple(map(weakref.ref, tracks)), revisions, tempos,
+                             tuple((event.offset, event.mpqn) for event in tempos), converter)
+        return converter
+
+    def clone(self):
+        """
+        copies the pattern without going through copy.deepcopy
+        :return: Pattern
+        """
+        return Pattern(resolution=self.resolution, format=self.format, tracks=[track.clone() for track in self])
+
+    def merge_tracks(self):
+        """
+        k-way merge of the tracks by offset in O(n log k). Events at equal offsets are ordered by track and then
+        by their order within their track. Tracks are expected to be in offset order. Events are not copied.
+        :return: Track
+        """
+        def _keyed(index, track):
+            for position, event in enumerate(track):
+                yield event.offset, index, position, event
+        merged = heapq.merge(*[_keyed(index, track) for index, track in enumerate(self)])
+        return Track([event for offset, index, position, event in merged])
+
+    def to_format0(self):
+        """
+        :return: format 0 Pattern of a single track made by merge_tracks
+        """
+        return Pattern(resolution=self.resolution, format=0, tracks=[self.merge_tracks()])
+
+    def rescale(self, resolution):
+        """
+        converts offsets and durations to resolution in place with transforms.Rescale. The ends of notes are
+        scaled rather than their durations, so notes that abut keep abutting, and rescaling by a whole ratio
+        and back is exact.
+        :param resolution: new resolution
+        :return: self
+        """
+        # transforms imports this module
+        from transforms import Pipeline, Rescale
+        return Pipeline(Rescale(resolution)).apply_pattern(self)
+
+    def view(self, start=None, stop=None, step=None):
+        """
+        :return: PatternView of the tracks in slice(start, stop, step)
+        """
+        return PatternView(self, slice(start, stop, step))
+
+    def window(self, start, end, sounding=True):
+        """
+        :param start: first tick of the window
+        :param end: tick the window stops before
+        :param sounding: see Track.events_in_range
+        :return: Pattern with each track cut down to the events in the window. Offsets are left as they are
+        """
+        return Pattern(resolution=self.resolution, format=self.format,
+                       tracks=[track.events_in_range(start, end, sounding) for track in self])
 
     def nearest_quantized_duration(self, duration):
         """
         :param duration: length in PPQs to quantize
         :return:
         """
-        if duration<=1:
-            return 1
-        power=int(math.floor(math.log(duration/self.resolution, 2)))
-        # if we are within a single quarter then get real granular.  beyond that we are going to assume quantizing
-        # to the nearest ratios of a quarter below.
-        if power<0:
-            ratios=((pow(2, ratio)*multiple) for ratio in range(power, power+2) for multiple in (2/3, 3/4, 1))
-        else:
-            ratios=(duration//self.resolution+ratio for ratio in (0, 1/4, 1/3, 1/2, 2/3, 3/4, 1))
-        quantized=[int(self.resolution*ratio) for ratio in ratios]
-        for index in range(1, len(quantized)):
-            if duration<=quantized[index]:
-                return quantized[index] if quantized[index]-duration<=duration-quantized[index-1] else quantized[index-1]
-        return quantized[-1]
+        return nearest_quantized_duration(self.resolution, duration)
 
     #--- private api ---#
+    def __getstate__(self):
+        # cached state is left behind by copies and pickles and rebuilt on demand
+        return dict((key, value) for key, value in self.__dict__.iteritems() if not key.startswith("_"))
+
     def __repr__(self):
         return "midi.Pattern(format=%r, resolution=%r, tracks=\\\n%s)" % \
                (self.format, self.resolution, pformat(list(self)))
 
     def __getitem__(self, item):
         if isinstance(item, slice):
-            indices=item.indices(len(self))
-            return Pattern(resolution=self.resolution, format=self.format, tracks=[super(Pattern, self).__getitem__(i) for i in xrange(*indices)])
+            return Pattern(resolution=self.resolution, format=self.format, tracks=super(Pattern, self).__getitem__(item))
         else:
             return super(Pattern, self).__getitem__(item)
 
@@ -70,19 +183,95 @@ class Pattern(list):
 
 
 class Track(list):
+    """
+    All changes to membership go through _changed() so that cached state can be kept current. Cached state
+    lives in class level defaults until first set so that copies made without __init__ start out clean.
+    """
+    _tempo_revision = 0
+    _duration = None
+    _index = None
+    _ranges = None
+
     # noinspection PyDefaultArgument
     def __init__(self, events=[]):
         super(Track, self).__init__(events)
+        self._changed(self, ())
 
     #--- public api ---#
     def get_duration(self):
-        return max([event.offset+getattr(event, "duration", 0) for event in self])
+        """
+        maintained as events are added and recomputed after removals or once the offset or duration of one of
+        the events of this track has been changed
+        :return: offset at which the last event ends
+        """
+        if self._duration is None:
+            # the slots behind offset and duration are read directly, the properties are several times slower
+            self._duration = max([event._offset+getattr(event, "_duration", 0) for event in self])
+        return self._duration
     duration=property(get_duration)
 
+    def invalidate(self):
+        """
+        drops cached state derived from the events in this track. Changes to the offset or duration of an event
+        are picked up without it. Only needed after changing the metacommand of an event in place, which moves it
+        to another group of the index. Changes to data are never cached.
+        """
+        self._duration = None
+        self._index = None
+        self._ranges = None
+
+    def get_index(self):
+        """
+        built in a single pass on first use of its groups and then kept current by changes to this track.
+        track.index(event) is list.index and does not build anything, see TrackIndex
+        :return: TrackIndex
+        """
+        if self._index is None:
+            self._index = TrackIndex(self)
+        return self._index
+    index=property(get_index)
+
+    def events_of(self, cls):
+        """
+        :param cls: event class. Subclasses are not included
+        :return: list of events of exactly class cls in track order
+        """
+        return list(self.index.classes.get(cls, ()))
+
+    def clone(self):
+        """
+        :return: Track of copies of the events made with AbstractEvent.clone
+        """
+        track = Track.__new__(Track)
+        super(Track, track).__init__([event.clone() for event in self])
+        track._duration = self._duration
+        track._own(track)
+        return track
+
+    def view(self, start=None, stop=None, step=None):
+        """
+        :return: TrackView of the events in slice(start, stop, step)
+        """
+        return TrackView(self, slice(start, stop, step))
+
+    def events_in_range(self, start, end, sounding=True):
+        """
+        backed by a RangeIndex that is built on first use and dropped whenever this track changes
+        :param start: first tick of the range
+        :param end: tick the range stops before
+        :param sounding: if True then events that start before start and last past it are included
+        :return: Track of the events in track order. The events are not copied
+        """
+        if self._ranges is None:
+            self._ranges = RangeIndex(self)
+        get = super(Track, self).__getitem__
+        return Track([get(position) for position in self._ranges.positions_in_range(start, end, sounding)])
+
     def insert_event(self, event, bias="right"):
         vof = util.bisect_left if bias=="left" else util.bisect_right
         index = vof(a=self, x=event.offset, vof=lambda o: o.offset)
-        self.insert(index, event)
+        super(Track, self).insert(index, event)
+        self._changed((event,), (), "left" if bias=="left" else "right")
 
     def next_event(self, offset, index_from=0):
         index = self.next_event_index(offset, index_from)
@@ -93,16 +282,129 @@ class Track(list):
         return index if index<len(self) else -1
 
     def get_text(self, metacommand, dfault=None):
-        result=getattr(util.find(lambda e: isinstance(e, events.MetaEventWithText) and e.metacommand==metacommand, self), "text", None)
+        result=getattr(util.find(lambda e: isinstance(e, events.MetaEventWithText), self.index.meta.get(metacommand, ())), "text", None)
         if result is not None:
             return result
         return dfault() if callable(dfault) else dfault
 
+    #--- list mutation ---#
+    def append(self, event):
+        super(Track, self).append(event)
+        self._changed((event,), (), "end")
+
+    def extend(self, events):
+        events = list(events)
+        super(Track, self).extend(events)
+        self._changed(events, (), "end")
+
+    def insert(self, index, event):
+        super(Track, self).insert(index, event)
+        self._changed((event,), ())
+
+    def remove(self, event):
+        super(Track, self).remove(event)
+        self._changed((), (event,))
+
+    def pop(self, index=-1):
+        event = super(Track, self).pop(index)
+        self._changed((), (event,))
+        return event
+
+    def __setitem__(self, item, value):
+        removed = super(Track, self).__getitem__(item)
+        if isinstance(item, slice):
+            value = list(value)
+            super(Track, self).__setitem__(item, value)
+            self._changed(value, removed)
+        else:
+            super(Track, self).__setitem__(item, value)
+            self._changed((value,), (removed,))
+
+    def __delitem__(self, item):
+        removed = super(Track, self).__getitem__(item)
+        super(Track, self).__delitem__(item)
+        self._changed((), removed if isinstance(item, slice) else (removed,))
+
+    def __setslice__(self, i, j, events):
+        self.__setitem__(slice(max(0, i), max(0, j)), events)
+
+    def __delslice__(self, i, j):
+        self.__delitem__(slice(max(0, i), max(0, j)))
+
+    def __iadd__(self, events):
+        self.extend(events)
+        return self
+
+    def __imul__(self, count):
+        added = list(self)*(max(count, 1)-1)
+        removed = list(self) if count<=0 else ()
+        super(Track, self).__imul__(count)
+        self._changed(added, removed, "end")
+        return self
+
+    def sort(self, *args, **kwargs):
+        super(Track, self).sort(*args, **kwargs)
+        self._index = None
+        self._ranges = None
+
+    def reverse(self):
+        super(Track, self).reverse()
+        self._index = None
+        self._ranges = None
+
     #--- private api ---#
+    def _changed(self, added, removed, position=None):
+        """
+        called after events have been added to and/or removed from this track
+        :param position: where added went: "end", "left"/"right" as per insert_event or None if unknown
+        """
+        self._own(added)
+        if removed:
+            self._duration = None
+        elif added and self._duration is not None:
+            self._duration = max(self._duration, max([event._offset+getattr(event, "_duration", 0) for event in added]))
+        for event in itertools.chain(added, removed):
+            if isinstance(event, events.SetTempoEvent):
+                self._tempo_revision += 1
+                break
+        self._ranges = None
+        index = self._index
+        if index is not None:
+            for event in removed:
+                index.remove(event)
+            if added:
+                if position is None:
+                    self._index = None
+                else:
+                    for event in added:
+                        index.add(event, position)
+
+    def _own(self, added):
+        """
+        records this track with the added events, so that changes to their offset or duration reach it weakly
+        """
+        owner = weakref.ref(self)
+        for event in added:
+            # events new to any track are the common case and are recorded without a call
+            if getattr(event, "_owners", None) is None:
+                event._owners = owner
+            else:
+                event._add_owner(owner)
+
+    def _event_changed(self):
+        """
+        called by an event of this track after its offset or duration has changed
+        """
+        self._duration = None
+        self._ranges = None
+
+    def __getstate__(self):
+        # cached state is left behind by copies and pickles and rebuilt on demand
+        return dict((key, value) for key, value in self.__dict__.iteritems() if not key.startswith("_"))
+
     def __getitem__(self, item):
         if isinstance(item, slice):
-            indices = item.indices(len(self))
-            return Track([super(Track, self).__getitem__(i) for i in xrange(*indices)])
+            return Track(super(Track, self).__getitem__(item))
         else:
             return super(Track, self).__getitem__(item)
 
@@ -115,27 +417,309 @@ class Track(list):
         return "midi.Track(\\\n  %s)" % (pformat(list(self)).replace('\n', '\n  '),)
 
 
+class TrackIndex(object):
+    """
+    events of a track grouped by class and, for meta events, by metacommand. Groups are in track order.
+        - classes: dict of event class to list of events
+        - meta: dict of metacommand to list of events
+    Track.index shadows list.index on purpose. Calling an index is a plain list.index on its track, so that
+    track.index(event) keeps working, and the groups are only built on first access to classes or meta.
+    """
+    def __init__(self, track):
+        self._track = track
+        self._classes = None
+        self._meta = None
+
+    #--- public api ---#
+    def get_classes(self):
+        self._build()
+        return self._classes
+    classes = property(get_classes)
+
+    def get_meta(self):
+        self._build()
+        return self._meta
+    meta = property(get_meta)
+
+    def is_built(self):
+        return self._classes is not None
+
+    def add(self, event, position="end"):
+        """
+        :param position: "end" or the insert_event bias used to place event in its track
+        """
+        if self._classes is None:
+            return
+        self._add(self._classes, event.__class__, event, position)
+        if isinstance(event, events.MetaEvent):
+            self._add(self._meta, event.metacommand, event, position)
+
+    def remove(self, event):
+        if self._classes is None:
+            return
+        self._remove(self._classes, event.__class__, event)
+        if isinstance(event, events.MetaEvent):
+            self._remove(self._meta, event.metacommand, event)
+
+    #--- private api ---#
+    def _build(self):
+        if self._classes is None:
+            self._classes = {}
+            self._meta = {}
+            for event in self._track:
+                self.add(event)
+
+    @staticmethod
+    def _add(groups, key, event, position):
+        group = groups.get(key)
+        if group is None:
+            groups[key] = [event]
+        elif position=="end":
+            group.append(event)
+        else:
+            vof = util.bisect_left if position=="left" else util.bisect_right
+            group.insert(vof(a=group, x=event.offset, vof=lambda o: o.offset), event)
+
+    @staticmethod
+    def _remove(groups, key, event):
+        group = groups[key]
+        # by identity, a track may hold more than one event with equal value
+        for index in xrange(len(group)):
+            if group[index] is event:
+                del group[index]
+                break
+        if not group:
+            del groups[key]
+
+    def __call__(self, *args):
+        return list.index(self._track, *args)
+
+
+class RangeIndex(object):
+    """
+    positions of a track's events in order of offset, alongside each event's end and the running maximum of the
+    ends. The running maximum never decreases, so the first event that can still be sounding at a tick is found
+    by bisection rather than by scanning from the start of the track.
+    """
+    def __init__(self, track):
+        order = sorted(xrange(len(track)), key=lambda position: track[position].offset)
+        self.positions = array('l', order)
+        self.offsets = array('l', (track[position].offset for position in order))
+        self.ends = array('l', (track[position].offset+getattr(track[position], "duration", 0) for position in order))
+        self.max_ends = array('l', self.ends)
+        for index in xrange(1, len(self.max_ends)):
+            if self.max_ends[index]<self.max_ends[index-1]:
+                self.max_ends[index] = self.max_ends[index-1]
+
+    #--- public api ---#
+    def positions_in_range(self, start, end, sounding=True):
+        """
+        :param start: first tick of the range
+        :param end: tick the range stops before
+        :param sounding: if True then events that start before start and end after it are included
+        :return: sorted list of track positions
+        """
+        lo = bisect.bisect_left(self.offsets, start)
+        hi = bisect.bisect_left(self.offsets, end)
+        result = list(self.positions[lo:hi]) if lo<hi else []
+        if sounding and start<end:
+            first = bisect.bisect_right(self.max_ends, start, 0, lo)
+            result.extend(self.positions[index] for index in xrange(first, lo) if self.ends[index]>start)
+        result.sort()
+        return result
+
+
+class SliceView(object):
+    """
+    read-only window onto positions of a list that shares the list's storage. The positions are fixed when the
+    view is made, so later changes to the list show through at those positions. The first mutation through
+    the view copies its items into a container of its own and the view follows that from then on.
+    """
+    MUTATORS = ('append', 'extend', 'insert', 'remove', 'pop', 'sort', 'reverse')
+
+    def __init__(self, items, item):
+        """
+        :param items: list to view
+        :param item: slice of items
+        """
+        start, stop, step = item.indices(len(items))
+        self._items = items
+        # (start, step, count) within items or None once the view has its own container
+        self._range = (start, step, len(xrange(start, stop, step)))
+
+    #--- public api ---#
+    def materialize(self):
+        """
+        :return: new container of the viewed items
+        """
+        raise NotImplementedError
+
+    def is_materialized(self):
+        return self._range is None
+
+    #--- private api ---#
+    def _own(self):
+        if self._range is not None:
+            self._items = self.materialize()
+            self._range = None
+        return self._items
+
+    def _position(self, index):
+        start, step, count = self._range
+        if index<0:
+            index += count
+        if not 0<=index<count:
+            raise IndexError("view index out of range")
+        return start+index*step
+
+    def __len__(self):
+        return len(self._items) if self._range is None else self._range[2]
+
+    def __iter__(self):
+        if self._range is None:
+            return iter(self._items)
+        start, step, count = self._range
+        # by position, islice would step through every item ahead of start
+        items = self._items
+        return (list.__getitem__(items, index) for index in xrange(start, start+count*step, step))
+
+    def __getitem__(self, item):
+        if self._range is None:
+            return self._items[item]
+        if isinstance(item, slice):
+            start, step, count = self._range
+            first, stop, stride = item.indices(count)
+            view = self.__class__.__new__(self.__class__)
+            view.__dict__.update(self.__dict__)
+            view._range = (start+first*step, step*stride, len(xrange(first, stop, stride)))
+            return view
+        return list.__getitem__(self._items, self._position(item))
+
+    def __getslice__(self, i, j):
+        return self.__getitem__(slice(i, j))
+
+    def __iadd__(self, items):
+        self._own().extend(items)
+        return self
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name in self.MUTATORS:
+            return getattr(self._own(), name)
+        if self._range is None:
+            return getattr(self._items, name)
+        raise AttributeError(name)
+
+    def __setitem__(self, item, value):
+        self._own()[item] = value
+
+    def __delitem__(self, item):
+        del self._own()[item]
+
+
+class TrackView(SliceView):
+    """
+    SliceView of a Track. Mutation copies the viewed events into a Track of the view's own.
+    """
+    MUTATORS = SliceView.MUTATORS+('insert_event',)
+
+    #--- public api ---#
+    def materialize(self):
+        return Track(list(self))
+
+    def get_duration(self):
+        if self._range is None:
+            return self._items.duration
+        return max([event.offset+getattr(event, "duration", 0) for event in self])
+    duration=property(get_duration)
+
+    def next_event(self, offset, index_from=0):
+        index = self.next_event_index(offset, index_from)
+        return self[index] if index>-1 else None
+
+    def next_event_index(self, offset, index_from=0):
+        index=util.bisect_left(a=self, x=offset, lo=index_from, vof=lambda o: o.offset)
+        return index if index<len(self) else -1
+
+    #--- private api ---#
+    def __repr__(self):
+        return "midi.TrackView(\\\n  %s)" % (pformat(list(self)).replace('\n', '\n  '),)
+
+
+class PatternView(SliceView):
+    """
+    SliceView of a Pattern. Mutation copies the viewed tracks, though not their events, into a Pattern of the
+    view's own.
+    """
+
+    def __init__(self, pattern, item):
+        super(PatternView, self).__init__(pattern, item)
+        self.resolution = pattern.resolution
+        self.format = pattern.format
+
+    #--- public api ---#
+    def materialize(self):
+        return Pattern(resolution=self.resolution, format=self.format, tracks=list(self))
+
+    def get_duration(self):
+        return max([track.duration for track in self])
+    duration=property(get_duration)
+
+    #--- private api ---#
+    def __repr__(self):
+        return "midi.PatternView(format=%r, resolution=%r, tracks=\\\n%s)" % \
+               (self.format, self.resolution, pformat(list(self)))
+
+
 class TickConverter():
+    # tempo in effect before the first SetTempoEvent
+    DEFAULT_BPM=120
+
     def __init__(self, tempos, resolution=220):
         """
         constructor
-        :param tempos: collection of SetTempoEvent
+        :param tempos: collection of SetTempoEvent. DEFAULT_BPM applies up to the first of them
         :param resolution:
         """
         self._tempos=list(tempos)
         self._resolution=resolution
         self._tempos.sort(cmp=lambda a, b: a.offset-b.offset)
+        if not self._tempos or self._tempos[0].offset>0:
+            tempo=events.SetTempoEvent(offset=0)
+            tempo.bpm=self.DEFAULT_BPM
+            self._tempos.insert(0, tempo)
         self._offsets=tuple(map(lambda e: e.offset, self._tempos))
         self._seconds=[0.0]
         for index in range(1, len(self._tempos)):
             tempo_p=self._tempos[index-1]
             tempo_c=self._tempos[index]
             self._seconds.append(self._seconds[index-1]+self._ticks_at_tempo_to_seconds(tempo_c.offset-tempo_p.offset, tempo_p))
+        self._spqns=tuple(map(lambda e: e.spqn, self._tempos))
 
     def offset_to_seconds(self, offset):
-        index=bisect.bisect_right(self._offsets, offset)-1
+        index=max(bisect.bisect_right(self._offsets, offset)-1, 0)
         return self._seconds[index]+self._ticks_at_tempo_to_seconds(offset-self._offsets[index], self._tempos[index])
 
+    def offsets_to_seconds(self, offsets):
+        """
+        batch offset_to_seconds. Walks the tempo map once over the offsets in sorted order.
+        :param offsets: sequence of offsets, sorted or not
+        :return: array('d') or numpy array if offsets is a numpy array
+        """
+        if numpy is not None and isinstance(offsets, numpy.ndarray):
+            index=numpy.maximum(numpy.searchsorted(self._offsets, offsets, side="right")-1, 0)
+            return numpy.array(self._seconds)[index]+\
+                   ((offsets-numpy.array(self._offsets)[index])/float(self._resolution))*numpy.array(self._spqns)[index]
+        result=array('d', [0.0])*len(offsets)
+        index, count=0, len(self._offsets)
+        for position in self._sorted_positions(offsets):
+            offset=offsets[position]
+            while index+1<count and self._offsets[index+1]<=offset:
+                index+=1
+            result[position]=self._seconds[index]+((offset-self._offsets[index])/float(self._resolution))*self._spqns[index]
+        return result
+
     def duration_to_seconds(self, offset, duration):
         return self.offset_to_seconds(offset+duration)-self.offset_to_seconds(offset)
 
@@ -148,6 +732,54 @@ class TickConverter():
         offset=self.offset_to_seconds(event.offset)
         return offset, (self.offset_to_seconds(event.offset+event.duration)-offset)
 
+    def events_to_seconds(self, events):
+        """
+        batch event_to_seconds. Events without a duration get a duration of 0
+        :param events: sequence of midi.AbstractEvent such as a Track
+        :return: (offsets, durations) as array('d')
+        """
+        starts=[event.offset for event in events]
+        offsets=self.offsets_to_seconds(starts+[offset+getattr(event, "duration", 0) for offset, event in zip(starts, events)])
+        count=len(starts)
+        return offsets[:count], array('d', map(float.__sub__, offsets[count:], offsets[:count]))
+
+    def seconds_to_offset(self, seconds):
+        """
+        inverse of offset_to_seconds
+        :param seconds: float
+        :return: nearest offset in ticks
+        """
+        index=max(bisect.bisect_right(self._seconds, seconds)-1, 0)
+        return self._offsets[index]+int(round((seconds-self._seconds[index])*self._resolution/self._spqns[index]))
+
+    def seconds_to_offsets(self, seconds):
+        """
+        batch seconds_to_offset
+        :param seconds: sequence of seconds, sorted or not
+        :return: array('l') or numpy array if seconds is a numpy array
+        """
+        if numpy is not None and isinstance(seconds, numpy.ndarray):
+            index=numpy.maximum(numpy.searchsorted(self._seconds, seconds, side="right")-1, 0)
+            ticks=numpy.rint((seconds-numpy.array(self._seconds)[index])*self._resolution/numpy.array(self._spqns)[index])
+            return numpy.array(self._offsets)[index]+ticks.astype(numpy.int64)
+        result=array('l', [0])*len(seconds)
+        index, count=0, len(self._seconds)
+        for position in self._sorted_positions(seconds):
+            value=seconds[position]
+            while index+1<count and self._seconds[index+1]<=value:
+                index+=1
+            result[position]=self._offsets[index]+int(round((value-self._seconds[index])*self._resolution/self._spqns[index]))
+        return result
+
     #--- private api ---#
+    @staticmethod
+    def _sorted_positions(values):
+        """
+        :return: positions of values in ascending order of value
+        """
+        if all(values[index-1]<=values[index] for index in xrange(1, len(values))):
+            return xrange(len(values))
+        return sorted(xrange(len(values)), key=values.__getitem__)
+
     def _ticks_at_tempo_to_seconds(self, ticks, tempo):
         return (ticks/float(self._resolution))*tempo.spqn
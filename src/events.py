@@ -1,5 +1,6 @@
 import copy
 import math
+import operator
 
 class EventRegistry(object):
     Events = {}
@@ -22,7 +23,10 @@ class AbstractEvent(object):
     name = "Generic MIDI Event"
     length = 0
     statusmsg = 0x0
-    __slots__ = ['offset', 'data']
+    # _owners: weak reference, or tuple of them, to the tracks this event has been added to. See Track._changed
+    __slots__ = ['_offset', 'data', '_owners']
+    # slots copied by clone in addition to offset and data
+    _clone_slots = ()
 
     class __metaclass__(type):
         def __init__(cls, name, bases, dict):
@@ -30,7 +34,8 @@ class AbstractEvent(object):
                 EventRegistry.register_event(cls, bases)
 
     def __init__(self, **kw):
-        self.offset = 0
+        # a new event belongs to no track yet, so there is nobody to tell about its offset
+        self._offset = kw.pop('offset', 0)
         if type(self.length) == int:
             self.data = [0] * self.length
         else:
@@ -38,11 +43,77 @@ class AbstractEvent(object):
         for key in kw:
             setattr(self, key, kw[key])
 
+    def from_raw(cls, offset, data):
+        """
+        builds an event from decoded fields without going through the keyword constructor. Meant for readers and
+        other code that creates events in bulk.
+        :param offset: absolute offset in ticks
+        :param data: list or tuple of data bytes, used as is. A tuple is replaced by a list on the first
+            write through a property
+        """
+        event = cls.__new__(cls)
+        event._offset = offset
+        event.data = data
+        return event
+    from_raw = classmethod(from_raw)
+
+    def clone(self):
+        """
+        copies this event by direct assignment, which is much cheaper than copy.deepcopy. A data list is
+        copied, a tuple of interned data is shared.
+        :return: event of the same class
+        """
+        event = self.__class__.__new__(self.__class__)
+        event._offset = self._offset
+        event.data = list(self.data) if type(self.data) is list else self.data
+        for key in self._clone_slots:
+            setattr(event, key, getattr(self, key))
+        if getattr(self, '__dict__', None):
+            event.__dict__.update(self.__dict__)
+        return event
+
+    # the getters of offset and duration are attrgetters, which read the slot without a Python-level call
+    get_offset = operator.attrgetter('_offset')
+    def set_offset(self, offset):
+        self._offset = offset
+        self._touched()
+    offset = property(get_offset, set_offset)
+
+    def _add_owner(self, owner):
+        """
+        :param owner: weakref.ref to a track this event has been added to
+        """
+        owners = getattr(self, '_owners', None)
+        if owners is None or owners is owner:
+            self._owners = owner
+        else:
+            # tracks that have since been released are dropped
+            owners = owners if type(owners) is tuple else (owners,)
+            self._owners = tuple(ref for ref in owners if ref is not owner and ref() is not None)+(owner,)
+
+    def _touched(self):
+        """
+        tells the tracks holding this event that its offset or duration has changed
+        """
+        owners = getattr(self, '_owners', None)
+        if owners is None:
+            return
+        for ref in (owners if type(owners) is tuple else (owners,)):
+            track = ref()
+            if track is not None:
+                track._event_changed()
+
+    def _set_datum(self, index, value):
+        # payloads read with interned=True are shared tuples, copy on write
+        if type(self.data) is tuple:
+            self.data = list(self.data)
+        self.data[index] = value
+
     def __deepcopy__(self, memo, keys=tuple()):
         kargs={}
         for key in keys+('offset', 'data'):
             kargs[key]=copy.deepcopy(getattr(self, key), memo)
-        return EventRegistry.Events[self.statusmsg](**kargs)
+        return type(self)(**kargs)
 
     def __baserepr__(self, keys=tuple()):
         keys = ('offset',) + keys + ('data',)
@@ -61,6 +132,7 @@ class AbstractEvent(object):
 class Event(AbstractEvent):
     name = 'Event'
     __slots__ = ['channel']
+    _clone_slots = ('channel',)
 
     def __init__(self, **kw):
         if 'channel' not in kw:
@@ -68,6 +140,14 @@ class Event(AbstractEvent):
             kw['channel'] = 0
         super(Event, self).__init__(**kw)
 
+    def from_raw(cls, offset, data, channel=0):
+        event = cls.__new__(cls)
+        event._offset = offset
+        event.data = data
+        event.channel = channel
+        return event
+    from_raw = classmethod(from_raw)
+
     def __deepcopy__(self, memo, keys=tuple()):
         return super(Event, self).__deepcopy__(memo, keys + ('channel',))
 
@@ -89,6 +169,18 @@ class MetaEvent(AbstractEvent):
     metacommand = 0x0
     name = 'Meta Event'
 
+    def from_raw(cls, offset, data, metacommand=None):
+        event = cls.__new__(cls)
+        event._offset = offset
+        event.data = data
+        if metacommand is not None and metacommand != cls.metacommand:
+            event.metacommand = metacommand
+        return event
+    from_raw = classmethod(from_raw)
+
+    def __deepcopy__(self, memo, keys=tuple()):
+        return super(MetaEvent, self).__deepcopy__(memo, keys + ('metacommand',))
+
     def is_event(cls, statusmsg):
         return (statusmsg == 0xFF)
     is_event = classmethod(is_event)
@@ -106,13 +198,13 @@ class NoteEvent(Event):
     def get_pitch(self):
         return self.data[0]
     def set_pitch(self, val):
-        self.data[0] = val
+        self._set_datum(0, val)
     pitch = property(get_pitch, set_pitch)
 
     def get_velocity(self):
         return self.data[1]
     def set_velocity(self, val):
-        self.data[1] = val
+        self._set_datum(1, val)
     velocity = property(get_velocity, set_velocity)
 
     def __repr__(self):
@@ -122,12 +214,29 @@ class NoteEvent(Event):
 class NoteOnEvent(NoteEvent):
     statusmsg = 0x90
     name = 'Note On'
-    __slots__ = ['duration']
+    __slots__ = ['_duration']
+    _clone_slots = ('channel', '_duration')
 
     def __init__(self, **kw):
-        self.duration=0     # default in event that it is not known yet
+        # default in event that it is not known yet
+        self._duration = kw.pop('duration', 0)
         super(NoteOnEvent, self).__init__(**kw)
 
+    def from_raw(cls, offset, data, channel=0, duration=0):
+        event = cls.__new__(cls)
+        event._offset = offset
+        event.data = data
+        event.channel = channel
+        event._duration = duration
+        return event
+    from_raw = classmethod(from_raw)
+
+    get_duration = operator.attrgetter('_duration')
+    def set_duration(self, duration):
+        self._duration = duration
+        self._touched()
+    duration = property(get_duration, set_duration)
+
     def __deepcopy__(self, memo, keys=tuple()):
         return super(NoteOnEvent, self).__deepcopy__(memo, keys + ('duration',))
 
@@ -148,13 +257,13 @@ class AfterTouchEvent(Event):
     def get_pitch(self):
         return self.data[0]
     def set_pitch(self, val):
-        self.data[0] = val
+        self._set_datum(0, val)
     pitch = property(get_pitch, set_pitch)
 
     def get_value(self):
         return self.data[1]
     def set_value(self, val):
-        self.data[1] = val
+        self._set_datum(1, val)
     value = property(get_value, set_value)
 
 
@@ -165,13 +274,13 @@ class ControlChangeEvent(Event):
     __slots__ = ['control', 'value']
 
     def set_control(self, val):
-        self.data[0] = val
+        self._set_datum(0, val)
     def get_control(self):
         return self.data[0]
     control = property(get_control, set_control)
 
     def set_value(self, val):
-        self.data[1] = val
+        self._set_datum(1, val)
     def get_value(self):
         return self.data[1]
     value = property(get_value, set_value)
@@ -184,7 +293,7 @@ class ProgramChangeEvent(Event):
     __slots__ = ['value']
 
     def set_value(self, val):
-        self.data[0] = val
+        self._set_datum(0, val)
     def get_value(self):
         return self.data[0]
     value = property(get_value, set_value)
@@ -197,7 +306,7 @@ class ChannelAfterTouchEvent(Event):
     __slots__ = ['value']
 
     def set_value(self, val):
-        self.data[1] = val
+        self._set_datum(1, val)
     def get_value(self):
         return self.data[1]
     value = property(get_value, set_value)
@@ -213,8 +322,8 @@ class PitchWheelEvent(Event):
         return ((self.data[1] << 7) | self.data[0]) - 0x2000
     def set_pitch(self, pitch):
         value = pitch + 0x2000
-        self.data[0] = value & 0x7F
-        self.data[1] = (value >> 7) & 0x7F
+        self._set_datum(0, value & 0x7F)
+        self._set_datum(1, (value >> 7) & 0x7F)
     pitch = property(get_pitch, set_pitch)
 
 
@@ -244,6 +353,12 @@ class MetaEventWithText(MetaEvent):
         elif 'data' not in kw:
             self.data = [ord(c) for c in kw["text"]]
 
+    def from_raw(cls, offset, data, metacommand=None):
+        event = super(MetaEventWithText, cls).from_raw(offset, data, metacommand)
+        event.text = ''.join(chr(datum) for datum in data)
+        return event
+    from_raw = classmethod(from_raw)
+
     def __repr__(self):
         return self.__baserepr__(('text',))
 
@@ -363,25 +478,25 @@ class TimeSignatureEvent(MetaEvent):
     def get_numerator(self):
         return self.data[0]
     def set_numerator(self, val):
-        self.data[0] = val
+        self._set_datum(0, val)
     numerator = property(get_numerator, set_numerator)
 
     def get_denominator(self):
         return 2 ** self.data[1]
     def set_denominator(self, val):
-        self.data[1] = int(math.log(val, 2))
+        self._set_datum(1, int(math.log(val, 2)))
     denominator = property(get_denominator, set_denominator)
 
     def get_metronome(self):
         return self.data[2]
     def set_metronome(self, val):
-        self.data[2] = val
+        self._set_datum(2, val)
     metronome = property(get_metronome, set_metronome)
 
     def get_thirtyseconds(self):
         return self.data[3]
     def set_thirtyseconds(self, val):
-        self.data[3] = val
+        self._set_datum(3, val)
     thirtyseconds = property(get_thirtyseconds, set_thirtyseconds)
 
 
@@ -395,13 +510,13 @@ class KeySignatureEvent(MetaEvent):
         d = self.data[0]
         return d - 256 if d > 127 else d
     def set_alternatives(self, val):
-        self.data[0] = 256 + val if val < 0 else val
+        self._set_datum(0, 256 + val if val < 0 else val)
     alternatives = property(get_alternatives, set_alternatives)
 
     def get_minor(self):
         return self.data[1]
     def set_minor(self, val):
-        self.data[1] = val
+        self._set_datum(1, val)
     minor = property(get_minor, set_minor)
 
 
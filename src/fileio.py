@@ -1,15 +1,192 @@
 import copy
+import hashlib
+import heapq
+import mmap
+import multiprocessing
+import os
+import time
+from collections import deque
+from StringIO import StringIO
 from warnings import *
 
 from containers import *
 from events import *
-from struct import unpack, pack
+from tables import *
+from packed import pack_track, unpack_track, save_cache, load_cache, CacheError
+from struct import unpack, pack, pack_into
 from constants import *
 from util import *
 
-class FileReader(object):
+class NotePool(object):
+    """
+    pairs note-offs with pending note-ons of the same channel and pitch.
+    policies:
+        - "fifo": an overlapped note resolves its oldest instance (default)
+        - "lifo": an overlapped note resolves its newest instance
+    """
+    POLICIES=("fifo", "lifo")
+
+    def __init__(self, policy="fifo"):
+        """
+        :param policy: one of POLICIES or a dict of channel to policy. Channels not in the dict use "fifo"
+        """
+        if not isinstance(policy, dict):
+            policy=dict.fromkeys(range(16), policy)
+        for value in policy.itervalues():
+            if value not in self.POLICIES:
+                raise ValueError, "Unknown note policy: " + str(value)
+        self.lifo=frozenset(channel for channel in policy if policy[channel]=="lifo")
+        self._pool={}
+
+    #--- public api ---#
+    def note_on(self, event):
+        key=(event.channel, event.data[0])
+        notes=self._pool.get(key)
+        if notes is None:
+            self._pool[key]=deque((event,))
+        else:
+            notes.append(event)
+
+    def note_off(self, event):
+        """
+        resolves the duration of the pending note-on matching event
+        :param event: NoteOffEvent
+        :return: the resolved NoteOnEvent or None if there is no match
+        """
+        notes=self._pool.get((event.channel, event.data[0]))
+        if not notes:
+            return None
+        note_on=notes.pop() if event.channel in self.lifo else notes.popleft()
+        # notes are paired before they are added to a track, so there is no track to tell about the duration
+        note_on._duration=event._offset-note_on._offset
+        return note_on
+
+    def unresolved(self):
+        """
+        :return: list of note-ons that have not been resolved
+        """
+        return [event for notes in self._pool.itervalues() for event in notes]
+
+
+class ParseStats(object):
+    """
+    counters filled in by a FileReader created with stats:
+        - bytes_read: bytes of track data decoded
+        - events: event class name to count
+        - running_status_hits: channel events that reused the previous status byte
+        - errant_note_offs: note-offs without a pending note-on
+        - unresolved_notes: note-ons still pending at the end of their track
+        - unknown_meta_events: metacommand to count of meta events missing from the registry
+        - track_seconds: time spent decoding each track, in the order they were decoded
+    """
+
     def __init__(self):
+        self.bytes_read = 0
+        self.events = {}
+        self.running_status_hits = 0
+        self.errant_note_offs = 0
+        self.unresolved_notes = 0
+        self.unknown_meta_events = {}
+        self.track_seconds = []
+
+    #--- public api ---#
+    def count(self, event, data, pos):
+        """
+        :param event: decoded event
+        :param data: bytes the event was decoded from as integers
+        :param pos: index of the event's delta-time within data
+        """
+        name = event.__class__.__name__
+        self.events[name] = self.events.get(name, 0)+1
+        while data[pos] & 0x80:
+            pos += 1
+        if data[pos+1] < 0x80:
+            self.running_status_hits += 1
+        if isinstance(event, UnknownMetaEvent):
+            self.unknown_meta_events[event.metacommand] = self.unknown_meta_events.get(event.metacommand, 0)+1
+
+    def as_dict(self):
+        """
+        :return: dict of the counters suitable for JSON
+        """
+        result = dict((name, getattr(self, name)) for name in
+                      ("bytes_read", "running_status_hits", "errant_note_offs", "unresolved_notes", "track_seconds"))
+        result["events"] = dict(self.events)
+        result["unknown_meta_events"] = dict((str(cmd), count) for cmd, count in self.unknown_meta_events.iteritems())
+        result["seconds"] = sum(self.track_seconds)
+        return result
+
+    #--- private api ---#
+    def __repr__(self):
+        return "midi.ParseStats(bytes_read=%r, events=%r, seconds=%r)" % \
+            (self.bytes_read, sum(self.events.itervalues()), sum(self.track_seconds))
+
+
+class _RecordingIterator(object):
+    """
+    byte iterator that keeps what was taken from it since the last call to take()
+    """
+
+    def __init__(self, trackdata):
+        self._iter = iter(trackdata)
+        self._consumed = []
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        datum = self._iter.next()
+        self._consumed.append(datum)
+        return datum
+
+    def take(self):
+        consumed, self._consumed = self._consumed, []
+        return bytearray(''.join(consumed))
+
+
+def _read_blocks(midifile, size, blocksize):
+    """
+    reads size bytes from midifile in blocks of at most blocksize bytes, stopping early at end of file
+    """
+    while size > 0:
+        block = midifile.read(min(blocksize, size))
+        if not block:
+            return
+        size -= len(block)
+        yield block
+
+
+class FileReader(object):
+    """
+    engines:
+        - "buffer": decodes each track from a bytearray with an integer cursor (default)
+        - "iterator": the original engine, pulls bytes one at a time from an iterator
+    """
+    ENGINES=("buffer", "iterator")
+    # bytes of a track chunk read from the file at a time by iter_track_stream
+    STREAM_WINDOW = 1 << 12
+
+    def __init__(self, engine="buffer", note_policy="fifo", stats=None, interned=False):
+        """
+        :param engine: one of ENGINES
+        :param note_policy: overlapped note policy. See NotePool
+        :param stats: ParseStats to collect into or None. Tracks decoded by read_parallel's workers are not
+            collected
+        :param interned: if True then event payloads are tuples and equal payloads are shared between events.
+            Property setters replace a shared payload with a list of its own.
+        """
+        if engine not in self.ENGINES:
+            raise ValueError, "Unknown parse engine: " + str(engine)
+        NotePool(note_policy)   # validates the policy up front
+        self.engine=engine
+        self.note_policy=note_policy
         self.running_status=None
+        self.stats=stats
+        self.interned=interned
+        self._payloads={}
+        self._payload=self._intern_payload if interned else list
+        if stats is not None:
+            self._instrument(stats)
 
     def read(self, midifile):
         pattern = self.parse_file_header(midifile)
@@ -17,6 +194,66 @@ class FileReader(object):
             self.parse_track(midifile, track)
         return pattern
 
+    def read_lazy(self, midifile):
+        """
+        memory-maps midifile and scans its chunk headers. Tracks are decoded the first time they are accessed.
+        Files that cannot be mapped are read into memory instead.
+        :param midifile: file object positioned at the start of the file
+        :return: LazyPattern
+        """
+        try:
+            data = mmap.mmap(midifile.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, EnvironmentError, ValueError):
+            data = StringIO(midifile.read())
+        header = self.parse_file_header(data)
+        chunks = []
+        for index in xrange(len(header)):
+            trksz = self.parse_track_header(data)
+            chunks.append(TrackChunk(data.tell(), trksz))
+            data.seek(trksz, os.SEEK_CUR)
+        return LazyPattern(data, chunks, self, resolution=header.resolution, format=header.format)
+
+    def read_parallel(self, midifile, workers=None):
+        """
+        reads the chunk table and then decodes the tracks concurrently in a pool of processes. Tracks are
+        independent - running status and note pairing start over with each - so the result and warnings are the
+        same as read()'s.
+        :param midifile: file object positioned at the start of the file
+        :param workers: number of processes. None for one per cpu
+        :return: Pattern
+        """
+        pattern = self.parse_file_header(midifile)
+        jobs = []
+        for index in xrange(len(pattern)):
+            trksz = self.parse_track_header(midifile)
+            jobs.append((midifile.read(trksz), self.engine, self.note_policy))
+        pool = multiprocessing.Pool(workers)
+        try:
+            decoded = pool.map(_decode_track_packed, jobs)
+        finally:
+            pool.close()
+            pool.join()
+        # interned payloads are shared across tracks as they are by read()
+        payloads = self._payloads if self.interned else None
+        for index, (packed, caught) in enumerate(decoded):
+            for category, message in caught:
+                warn(message, category)
+            pattern[index] = unpack_track(packed, payloads=payloads)
+        return pattern
+
+    def read_tables(self, midifile):
+        """
+        reads midifile into NoteTables without creating note event objects
+        :param midifile: file object positioned at the start of the file
+        :return: Pattern of NoteTable
+        """
+        pattern = self.parse_file_header(midifile)
+        for index in xrange(len(pattern)):
+            trksz = self.parse_track_header(midifile)
+            pattern[index] = NoteTable()
+            self.parse_track_table(midifile.read(trksz), pattern[index])
+        return pattern
+
     def parse_file_header(self, midifile):
         # First four bytes are MIDI header
         magic = midifile.read(4)
@@ -48,33 +285,225 @@ class FileReader(object):
         return trksz
 
     def parse_track(self, midifile, track):
+        trksz = self.parse_track_header(midifile)
+        self.parse_track_data(midifile.read(trksz), track)
+
+    def parse_track_data(self, trackdata, track):
+        """
+        decodes the body of a track chunk into track, pairing note-ons with their note-offs
+        :param trackdata: raw bytes of the chunk following the track header
+        :param track: Track to append to
+        """
         self.running_status = None
-        offset = 0
+        pool = NotePool(self.note_policy)
+        # events are collected locally and handed to the track in one go
+        result = []
+        for event in self.iter_track_data(trackdata):
+            if isinstance(event, NoteOffEvent):
+                if pool.note_off(event) is None:
+                    if self.stats is not None:
+                        self.stats.errant_note_offs += 1
+                    warn("errant note off: {0}".format(event.pitch))
+            elif not isinstance(event, EndOfTrackEvent):
+                result.append(event)
+                if isinstance(event, NoteOnEvent):
+                    pool.note_on(event)
+        unresolved = pool.unresolved()
+        if unresolved:
+            # compact in a single pass rather than removing hanging notes one at a time
+            if self.stats is not None:
+                self.stats.unresolved_notes += len(unresolved)
+            unresolved = set(map(id, unresolved))
+            for event in result:
+                if id(event) in unresolved:
+                    warn("unresolved note: {0} at {1}".format(event.pitch, event.offset))
+            result = [event for event in result if id(event) not in unresolved]
+        track.extend(result)
+
+    def parse_track_table(self, trackdata, table):
+        """
+        decodes the body of a track chunk into table. Note-on and note-off messages are decoded in place
+        and paired by row. Everything else goes through parse_midi_event_at into table.events.
+        :param trackdata: raw bytes of the chunk following the track header
+        :param table: NoteTable to append to
+        """
+        self.running_status = None
+        stats = self.stats
+        lifo = NotePool(self.note_policy).lifo
         pool = {}
-        trksz = self.parse_track_header(midifile)
-        trackdata = iter(midifile.read(trksz))
-        while True:
+        data = bytearray(trackdata)
+        pos, end = 0, len(data)
+        offset = 0
+        while pos<end:
             try:
-                event = self.parse_midi_event(trackdata, offset)
-                if isinstance(event, NoteOffEvent):
-                    try:
-                        # regarding overlapped notes - policy is to resolve the oldest instance
-                        note_on=pool[event.pitch].pop(0)
-                        note_on.duration=event.offset-note_on.offset
-                    except:
-                        warn("errant note off: {0}".format(event.pitch))
-                elif not isinstance(event, EndOfTrackEvent):
-                    track.append(event)
-                    if isinstance(event, NoteOnEvent):
-                        pool.setdefault(event.pitch, []).append(event)
-                offset = event.offset
-            except StopIteration:
-                def _concat(a, k): a.extend(pool[k]); return a
-                for event in reduce(_concat, pool, []):
-                    warn("unresolved note: {0} at {1}".format(event.pitch, event.offset))
-                    track.remove(event)
+                tick, cursor = read_varlen_at(data, pos)
+                stsmsg = data[cursor]
+                status = stsmsg if stsmsg & 0x80 else self.running_status
+                if status is None or (status & 0xE0) != 0x80:
+                    event, pos = self.parse_midi_event_at(data, pos, offset)
+                    offset = event._offset
+                    if not isinstance(event, EndOfTrackEvent):
+                        table.append_event(event)
+                    continue
+                if stsmsg & 0x80:
+                    self.running_status = stsmsg
+                    cursor += 1
+                elif stats is not None:
+                    stats.running_status_hits += 1
+                pitch, velocity = data[cursor], data[cursor+1]
+                pos = cursor+2
+            except IndexError:
                 break
+            offset += tick
+            key = (status & 0x0F, pitch)
+            if status & 0xF0 == NoteOnEvent.statusmsg and velocity > 0:
+                row = table.append_note(offset, 0, key[0], pitch, velocity)
+                if key in pool:
+                    pool[key].append(row)
+                else:
+                    pool[key] = deque((row,))
+            else:
+                rows = pool.get(key)
+                if not rows:
+                    if stats is not None:
+                        stats.errant_note_offs += 1
+                    warn("errant note off: {0}".format(pitch))
+                    continue
+                row = rows.pop() if key[0] in lifo else rows.popleft()
+                table.durations[row] = offset-table.offsets[row]
+        unresolved = sorted(row for rows in pool.itervalues() for row in rows)
+        if stats is not None:
+            stats.unresolved_notes += len(unresolved)
+        for row in unresolved:
+            warn("unresolved note: {0} at {1}".format(table.pitches[row], table.offsets[row]))
+        table.compact(unresolved)
+
+    def iter_events(self, midifile, raw=False):
+        """
+        streams the events of midifile track by track without building a Pattern. Track chunks are decoded as
+        they are read, STREAM_WINDOW bytes at a time, so with raw=True memory is bounded by the window rather than
+        by the chunk. When pairing notes the events held back behind an unresolved note-on are kept as well.
+        :param midifile: file object positioned at the start of the file
+        :param raw: if True then note-on and note-off events are yielded as decoded without duration pairing
+        :return: generator of (track_index, event)
+        """
+        ntracks = len(self.parse_file_header(midifile))
+        for index in xrange(ntracks):
+            self.running_status = None
+            trksz = self.parse_track_header(midifile)
+            events = self.iter_track_stream(midifile, trksz)
+            if not raw:
+                events = self.pair_notes(events)
+            for event in events:
+                yield index, event
+
+    def pair_notes(self, events):
+        """
+        streaming counterpart of the pairing in parse_track. Events following an unresolved note-on are
+        held back until it resolves, so they come out in track order with their durations set.
+        :param events: events of a single track as decoded
+        :return: generator of events
+        """
+        pool = NotePool(self.note_policy)
+        pending = deque()
+        resolved = set()
+        for event in events:
+            if isinstance(event, NoteOffEvent):
+                note_on = pool.note_off(event)
+                if note_on is None:
+                    if self.stats is not None:
+                        self.stats.errant_note_offs += 1
+                    warn("errant note off: {0}".format(event.pitch))
+                    continue
+                resolved.add(id(note_on))
+                while pending and (id(pending[0]) in resolved or not isinstance(pending[0], NoteOnEvent)):
+                    resolved.discard(id(pending[0]))
+                    yield pending.popleft()
+            elif not isinstance(event, EndOfTrackEvent):
+                if isinstance(event, NoteOnEvent):
+                    pool.note_on(event)
+                    pending.append(event)
+                elif pending:
+                    pending.append(event)
+                else:
+                    yield event
+        unresolved = set(map(id, pool.unresolved()))
+        if self.stats is not None:
+            self.stats.unresolved_notes += len(unresolved)
+        for event in pending:
+            if id(event) in unresolved:
+                warn("unresolved note: {0} at {1}".format(event.pitch, event.offset))
+            else:
+                yield event
+
+    def iter_track_data(self, trackdata):
+        """
+        decodes the body of a track chunk with the engine this reader was created with.
+        Decoding stops quietly at the end of the data or at a truncated event.
+        :param trackdata: raw bytes of the chunk following the track header
+        :return: generator of events with absolute offsets
+        """
+        offset = 0
+        if self.engine=="buffer":
+            data = bytearray(trackdata)
+            pos, end = 0, len(data)
+            while pos<end:
+                try:
+                    event, pos = self.parse_midi_event_at(data, pos, offset)
+                except IndexError:
+                    return
+                yield event
+                offset = event._offset
+        else:
+            trackdata = iter(trackdata)
+            while True:
+                try:
+                    event = self.parse_midi_event(trackdata, offset)
+                except StopIteration:
+                    return
+                yield event
+                offset = event._offset
+
 
+    def iter_track_stream(self, midifile, size):
+        """
+        counterpart of iter_track_data that decodes a track chunk while reading it from midifile, holding at
+        most STREAM_WINDOW bytes of it plus the event that straddles two reads.
+        Once the generator is exhausted midifile is positioned after the chunk.
+        :param midifile: file object positioned after the track header
+        :param size: length of the chunk
+        :return: generator of events with absolute offsets
+        """
+        blocks = _read_blocks(midifile, size, self.STREAM_WINDOW)
+        offset = 0
+        if self.engine=="buffer":
+            data, pos = bytearray(), 0
+            while True:
+                try:
+                    event, pos = self.parse_midi_event_at(data, pos, offset)
+                except IndexError:
+                    block = next(blocks, None)
+                    if block is None:
+                        break
+                    # keep the undecoded tail and retry the event with the next block appended
+                    data, pos = data[pos:]+block, 0
+                    continue
+                yield event
+                offset = event._offset
+        else:
+            trackdata = (datum for block in blocks for datum in block)
+            if self.stats is not None:
+                trackdata = _RecordingIterator(trackdata)
+            while True:
+                try:
+                    event = self.parse_midi_event(trackdata, offset)
+                except StopIteration:
+                    break
+                yield event
+                offset = event._offset
+        # skip whatever follows a truncated event
+        for block in blocks:
+            pass
 
     def parse_midi_event(self, trackdata, offset):
         # first datum is varlen representing delta-time
@@ -91,7 +520,7 @@ class FileReader(object):
                 cls = EventRegistry.MetaEvents[cmd]
             datalen = read_varlen(trackdata)
             data = [ord(trackdata.next()) for x in range(datalen)]
-            return cls(offset=offset+tick, data=data, metacommand=cmd)
+            return cls.from_raw(offset+tick, self._payload(data), cmd)
         # is this event a Sysex Event?
         elif SysexEvent.is_event(stsmsg):
             data = []
@@ -100,15 +529,15 @@ class FileReader(object):
                 if datum == 0xF7:
                     break
                 data.append(datum)
-            return SysexEvent(offset=offset+tick, data=data)
+            return SysexEvent.from_raw(offset+tick, self._payload(data))
         # not a Meta MIDI event or a Sysex event, must be a general message
         else:
             def _create_event():
                 # catch usage of note off to specify a note off
                 if key==NoteOnEvent.statusmsg and data[1]==0:
-                    return EventRegistry.Events[NoteOffEvent.statusmsg](offset=offset + tick, channel=channel, data=data)
+                    return NoteOffEvent.from_raw(offset + tick, self._payload(data), channel)
                 else:
-                    return cls(offset=offset + tick, channel=channel, data=data)
+                    return cls.from_raw(offset + tick, self._payload(data), channel)
 
             key = stsmsg & 0xF0
             if key not in EventRegistry.Events:
@@ -125,8 +554,261 @@ class FileReader(object):
                 data = [ord(trackdata.next()) for x in range(cls.length)]
                 return _create_event()
 
+    def parse_midi_event_at(self, data, pos, offset):
+        """
+        buffer engine counterpart of parse_midi_event
+        :param data: bytearray of track data
+        :param pos: index of the event's delta-time within data
+        :param offset: absolute offset of the previous event
+        :return: (event, index of the next event)
+        :raises IndexError: if the event runs past the end of data
+        """
+        # first datum is varlen representing delta-time
+        tick, pos = read_varlen_at(data, pos)
+        offset += tick
+        # next byte is status message
+        stsmsg = data[pos]
+        pos += 1
+        # is the event a MetaEvent?
+        if stsmsg == MetaEvent.statusmsg:
+            cmd = data[pos]
+            datalen, pos = read_varlen_at(data, pos+1)
+            end = pos+datalen
+            if end > len(data):
+                raise IndexError("truncated meta event")
+            if cmd not in EventRegistry.MetaEvents:
+                warn("Unknown Meta MIDI Event: " + `cmd`, Warning)
+                cls = UnknownMetaEvent
+            else:
+                cls = EventRegistry.MetaEvents[cmd]
+            return cls.from_raw(offset, self._payload(data[pos:end]), cmd), end
+        # is this event a Sysex Event?
+        elif stsmsg == SysexEvent.statusmsg:
+            end = data.find('\xF7', pos)
+            if end < 0:
+                raise IndexError("unterminated sysex event")
+            return SysexEvent.from_raw(offset, self._payload(data[pos:end])), end+1
+        # not a Meta MIDI event or a Sysex event, must be a general message
+        key = stsmsg & 0xF0
+        if key not in EventRegistry.Events:
+            assert self.running_status, "Bad byte value"
+            key = self.running_status & 0xF0
+            cls = EventRegistry.Events[key]
+            channel = self.running_status & 0x0F
+            # stsmsg is the first data byte
+            pos -= 1
+        else:
+            self.running_status = stsmsg
+            cls = EventRegistry.Events[key]
+            channel = stsmsg & 0x0F
+        end = pos+cls.length
+        if end > len(data):
+            raise IndexError("truncated channel event")
+        payload = self._payload(data[pos:end])
+        # catch usage of note on to specify a note off
+        if key == NoteOnEvent.statusmsg and payload[1] == 0:
+            cls = NoteOffEvent
+        return cls.from_raw(offset, payload, channel), end
+
+    def _intern_payload(self, data):
+        payload = tuple(data)
+        return self._payloads.setdefault(payload, payload)
+
+    def _instrument(self, stats):
+        """
+        shadows the decoding methods of this instance with wrappers that collect into stats. Readers created
+        without stats run the plain methods.
+        """
+        iter_track_data = self.iter_track_data
+        iter_track_stream = self.iter_track_stream
+        parse_midi_event = self.parse_midi_event
+        parse_midi_event_at = self.parse_midi_event_at
+        parse_track_table = self.parse_track_table
+
+        def _timed(events):
+            seconds = 0.0
+            while True:
+                start = time.time()
+                event = next(events, None)
+                seconds += time.time()-start
+                if event is None:
+                    break
+                yield event
+            stats.track_seconds.append(seconds)
+
+        def _iter_track_data(trackdata):
+            stats.bytes_read += len(trackdata)
+            if self.engine=="iterator":
+                trackdata = _RecordingIterator(trackdata)
+            return _timed(iter_track_data(trackdata))
+
+        def _iter_track_stream(midifile, size):
+            stats.bytes_read += size
+            return _timed(iter_track_stream(midifile, size))
+
+        def _parse_midi_event(trackdata, offset):
+            event = parse_midi_event(trackdata, offset)
+            if isinstance(trackdata, _RecordingIterator):
+                stats.count(event, trackdata.take(), 0)
+            return event
+
+        def _parse_midi_event_at(data, pos, offset):
+            event, end = parse_midi_event_at(data, pos, offset)
+            stats.count(event, data, pos)
+            return event, end
+
+        def _parse_track_table(trackdata, table):
+            rows, errant, unresolved = len(table), stats.errant_note_offs, stats.unresolved_notes
+            stats.bytes_read += len(trackdata)
+            start = time.time()
+            parse_track_table(trackdata, table)
+            stats.track_seconds.append(time.time()-start)
+            # notes are decoded in place, so they are tallied from the rows
+            unresolved = stats.unresolved_notes-unresolved
+            note_ons = len(table)-rows+unresolved
+            note_offs = note_ons-unresolved+stats.errant_note_offs-errant
+            for cls, count in ((NoteOnEvent, note_ons), (NoteOffEvent, note_offs)):
+                stats.events[cls.__name__] = stats.events.get(cls.__name__, 0)+count
+
+        self.iter_track_data = _iter_track_data
+        self.iter_track_stream = _iter_track_stream
+        self.parse_midi_event = _parse_midi_event
+        self.parse_midi_event_at = _parse_midi_event_at
+        self.parse_track_table = _parse_track_table
+
+
+def _decode_track_packed(job):
+    """
+    worker side of FileReader.read_parallel
+    :param job: (trackdata, engine, note_policy)
+    :return: (packed track, list of (category, message) warned while decoding)
+    """
+    trackdata, engine, note_policy = job
+    track = Track()
+    with catch_warnings(record=True) as caught:
+        simplefilter("always")
+        FileReader(engine, note_policy).parse_track_data(trackdata, track)
+    return pack_track(track), [(warning.category, str(warning.message)) for warning in caught]
+
+
+class TrackChunk(object):
+    """
+    location of an undecoded track chunk's data within a LazyPattern's file
+    """
+    __slots__ = ['start', 'size']
+
+    def __init__(self, start, size):
+        self.start = start
+        self.size = size
+
+    def __repr__(self):
+        return "midi.TrackChunk(start=%r, size=%r)" % (self.start, self.size)
+
+
+class LazyPattern(Pattern):
+    """
+    Pattern created by FileReader.read_lazy. Tracks are decoded from the underlying file on first access
+    and may be released again. Releasing a track discards any changes made to it.
+    """
+    def __init__(self, data, chunks, reader, resolution=220, format=1):
+        """
+        :param data: mmap or file-like object with seek() and read()
+        :param chunks: list of TrackChunk
+        :param reader: FileReader used to decode tracks
+        """
+        super(LazyPattern, self).__init__(resolution=resolution, format=format, tracks=chunks)
+        self.max_decoded = None
+        self._data = data
+        self._reader = reader
+        self._decoded = []
+
+    #--- public api ---#
+    def is_decoded(self, index):
+        return not isinstance(super(LazyPattern, self).__getitem__(index), TrackChunk)
+
+    def release(self, index=None):
+        """
+        drops decoded tracks so that they are decoded again on next access
+        :param index: track index or None to release all decoded tracks
+        """
+        for track, chunk in list(self._decoded):
+            position = self._position(track)
+            if position is not None and (index is None or position==index%len(self)):
+                self._release(position, track, chunk)
+
+    def close(self):
+        self.release()
+        self._data.close()
+
+    #--- private api ---#
+    def _decode(self, index):
+        chunk = super(LazyPattern, self).__getitem__(index)
+        if not isinstance(chunk, TrackChunk):
+            return chunk
+        self._data.seek(chunk.start)
+        track = Track()
+        self._reader.parse_track_data(self._data.read(chunk.size), track)
+        super(LazyPattern, self).__setitem__(index, track)
+        self._decoded.append((track, chunk))
+        # evict the least recently decoded tracks beyond max_decoded
+        while self.max_decoded is not None and len(self._decoded)>max(self.max_decoded, 1):
+            track_e, chunk_e = self._decoded[0]
+            position = self._position(track_e)
+            if position is None:
+                # replaced by the caller, nothing to release
+                del self._decoded[0]
+            else:
+                self._release(position, track_e, chunk_e)
+        return track
+
+    def _position(self, track):
+        for position in xrange(len(self)):
+            if super(LazyPattern, self).__getitem__(position) is track:
+                return position
+        return None
+
+    def _release(self, position, track, chunk):
+        super(LazyPattern, self).__setitem__(position, chunk)
+        self._decoded = [item for item in self._decoded if item[0] is not track]
+
+    def __getstate__(self):
+        # unlike Pattern the private state of a LazyPattern is needed to decode its tracks
+        return dict((key, value) for key, value in self.__dict__.iteritems() if key!="_tempo_cache")
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            indices=item.indices(len(self))
+            return Pattern(resolution=self.resolution, format=self.format, tracks=[self._decode(i) for i in xrange(*indices)])
+        else:
+            return self._decode(item)
+
+    def __iter__(self):
+        for index in xrange(len(self)):
+            yield self._decode(index)
+
+
+# varlen encodings of every delta that fits in two bytes
+_VARLEN_CACHE = [write_varlen(value) for value in xrange(1<<14)]
+# how FileWriter.encode_events writes each event class, filled in on first use: _META, _SYSEX or, for channel
+# events, the status byte of each channel
+_META, _SYSEX = "meta", "sysex"
+_ENCODINGS = {}
+
 
 class FileWriter(object):
+    """
+    engines:
+        - "merge": sorts synthesized note-offs into their own stream and merges it with the track (default)
+        - "insert": the original engine, inserts each note-off into a copy of the track
+    """
+    ENGINES=("merge", "insert")
+
+    def __init__(self, engine="merge"):
+        if engine not in self.ENGINES:
+            raise ValueError, "Unknown write engine: " + str(engine)
+        self.engine=engine
+        self.RunningStatus=None
+
     def write(self, midifile, pattern):
         self.write_file_header(midifile, pattern)
         for track in pattern:
@@ -138,26 +820,96 @@ class FileWriter(object):
         midifile.write('MThd%s'%packdata)
 
     def write_track(self, midifile, track):
-        buf = ''
-        offset = 0
+        if self.engine=="merge":
+            track = self.merge_note_offs(track)
+        else:
+            track = self.insert_note_offs(track)
+        # the track header is patched in once the length is known
+        buf = bytearray(8)
+        self.RunningStatus = None
+        offset = self.encode_events(track, buf)
+        # append end-o-track event
+        self.encode_events([EndOfTrackEvent(offset=offset)], buf, offset)
+        pack_into(">4sL", buf, 0, 'MTrk', len(buf)-8)
+        midifile.write(buf)
+
+    def insert_note_offs(self, track):
+        """
+        :param track: Track
+        :return: copy of track with note-off events inserted for all note-on events
+        """
         track = copy.copy(track)
-        # insert note-off events for all note-on events
         for event in filter(lambda event: isinstance(event, NoteOnEvent), track):
-            track.insert_event(NoteOffEvent(channel=event.channel, offset=event.offset+event.duration, data=event.data), bias="left")
-        # append end-o-track event
-        event=track[-1] if len(track)>0 else None
-        track.append(EndOfTrackEvent(offset=getattr(event, "offset", 0)))
-        # write events and encode the buffer
-        self.RunningStatus = None
+            track.insert_event(NoteOffEvent.from_raw(event.offset+event.duration, event.data, event.channel), bias="left")
+        return track
+
+    def merge_note_offs(self, track):
+        """
+        generates the same sequence as insert_note_offs with a single merge pass
+        :param track: Track
+        :return: generator of events
+        """
+        note_offs = [NoteOffEvent.from_raw(event.offset+event.duration, event.data, event.channel)
+                     for event in track if isinstance(event, NoteOnEvent)]
+        # insert_event(bias="left") puts each note-off ahead of everything already at its offset, including
+        # note-offs inserted before it. Reversing ahead of the stable sort reproduces that order.
+        note_offs.reverse()
+        note_offs.sort(key=lambda event: event.offset)
+        index, count = 0, len(note_offs)
         for event in track:
-            buf += self.encode_midi_event(event, event.offset-offset)
-            offset = event.offset
-        buf = self.encode_track_header(len(buf)) + buf
-        midifile.write(buf)
+            while index<count and note_offs[index].offset<=event.offset:
+                yield note_offs[index]
+                index += 1
+            yield event
+        for index in xrange(index, count):
+            yield note_offs[index]
 
     def encode_track_header(self, trklen):
         return 'MTrk%s' % pack(">L", trklen)
 
+    def encode_events(self, events, buf, offset=0):
+        """
+        appends events to buf. Produces the same bytes as encode_midi_event, including running status, which
+        continues from and is left in RunningStatus.
+        :param events: iterable of events in offset order
+        :param buf: bytearray
+        :param offset: offset the first delta is measured from
+        :return: offset of the last event
+        """
+        extend, append = buf.extend, buf.append
+        varlens, cached = _VARLEN_CACHE, len(_VARLEN_CACHE)
+        encodings = _ENCODINGS
+        running = self.RunningStatus
+        status = running.statusmsg | running.channel if running else None
+        for event in events:
+            # the slot is read directly, offset is a property
+            tick = event._offset-offset
+            offset += tick
+            extend(varlens[tick] if 0<=tick<cached else write_varlen(tick))
+            cls = event.__class__
+            encoding = encodings.get(cls)
+            if encoding is None:
+                encoding = encodings[cls] = self._encoding(cls)
+            if encoding is _META:
+                append(0xFF)
+                append(event.metacommand)
+                size = len(event.data)
+                extend(varlens[size] if size<cached else write_varlen(size))
+                extend(event.data)
+            elif encoding is _SYSEX:
+                append(0xF0)
+                extend(event.data)
+                append(0xF7)
+            else:
+                byte = encoding[event.channel]
+                if byte != status:
+                    status = byte
+                    running = event
+                    append(byte)
+                extend(event.data)
+        self.RunningStatus = running
+        return offset
+
     def encode_midi_event(self, event, tick):
         ret = ''
         ret += write_varlen(tick)
@@ -183,21 +935,226 @@ class FileWriter(object):
             raise ValueError, "Unknown MIDI Event: " + str(event)
         return ret
 
-def write_midifile(midifile, pattern):
+    def _encoding(self, cls):
+        if issubclass(cls, MetaEvent):
+            return _META
+        elif issubclass(cls, SysexEvent):
+            return _SYSEX
+        elif issubclass(cls, Event):
+            return [cls.statusmsg | channel for channel in xrange(16)]
+        raise ValueError, "Unknown MIDI Event: " + str(cls)
+
+class StreamWriter(object):
+    """
+    writes a MIDI file an event at a time, so that nothing but the note-offs still to come is held in memory.
+    Each track chunk is written with a placeholder length that is patched when the track ends, as is the
+    track count in the file header on close, so the file must be seekable. A note-off is scheduled for each
+    note-on from its duration and written once events reach its offset, in the order the merge engine of
+    FileWriter would write it. Output matches write_midifile but for notes of zero duration, whose note-off is
+    written after rather than before the note-on.
+
+        with StreamWriter("out.mid", resolution=480) as writer:
+            for event in events:
+                writer.add_event(event)
+    """
+
+    def __init__(self, midifile, resolution=220, format=1):
+        """
+        :param midifile: path or seekable file object
+        :param resolution: PPQ
+        :param format: MIDI file format
+        """
+        self._owned = type(midifile) in (str, unicode)
+        if self._owned:
+            midifile = open(midifile, 'wb')
+        self.midifile = midifile
+        self.tracks = 0
+        self._writer = FileWriter()
+        self._header = midifile.tell()
+        self._writer.write_file_header(midifile, Pattern(resolution=resolution, format=format))
+        # file position of the open track's length or None
+        self._track = None
+        self._size = 0
+        self._offset = 0
+        self._pending = []
+        self._sequence = 0
+
+    #--- public api ---#
+    def start_track(self):
+        """
+        ends the open track, if any, and starts a new one. add_event starts the first track itself.
+        """
+        self.end_track()
+        self._writer.RunningStatus = None
+        self._track = self.midifile.tell()+4
+        self.midifile.write(self._writer.encode_track_header(0))
+
+    def add_event(self, event):
+        """
+        :param event: event with an offset no earlier than the last event added to the track
+        """
+        if self._track is None:
+            self.start_track()
+        if event.offset < self._offset:
+            raise ValueError, "Events must be added in offset order: " + str(event)
+        self._flush(event.offset)
+        self._write(event)
+        if isinstance(event, NoteOnEvent):
+            end = event.offset+event.duration
+            # later note-offs go first at equal offsets, as in FileWriter.merge_note_offs
+            heapq.heappush(self._pending, (end, -self._sequence, NoteOffEvent.from_raw(end, event.data, event.channel)))
+            self._sequence += 1
+
+    def add_events(self, events):
+        for event in events:
+            self.add_event(event)
+
+    def end_track(self):
+        """
+        writes the pending note-offs and the end of track event and patches the chunk length
+        """
+        if self._track is None:
+            return
+        self._flush(None)
+        self._write(EndOfTrackEvent(offset=self._offset))
+        end = self.midifile.tell()
+        self.midifile.seek(self._track)
+        self.midifile.write(pack(">L", self._size))
+        self.midifile.seek(end)
+        self.tracks += 1
+        self._track = None
+        self._size = self._offset = self._sequence = 0
+
+    def close(self):
+        """
+        ends the open track and patches the track count. Files opened by path are closed.
+        """
+        self.end_track()
+        end = self.midifile.tell()
+        self.midifile.seek(self._header+10)
+        self.midifile.write(pack(">H", self.tracks))
+        self.midifile.seek(end)
+        if self._owned:
+            self.midifile.close()
+
+    #--- private api ---#
+    def _flush(self, offset):
+        """
+        writes the pending note-offs up to and including offset or all of them if offset is None
+        """
+        pending = self._pending
+        while pending and (offset is None or pending[0][0] <= offset):
+            self._write(heapq.heappop(pending)[2])
+
+    def _write(self, event):
+        chunk = bytearray()
+        self._offset = self._writer.encode_events((event,), chunk, self._offset)
+        self._size += len(chunk)
+        self.midifile.write(chunk)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            self.close()
+        elif self._owned:
+            self.midifile.close()
+        return False
+
+
+def write_midifile(midifile, pattern, engine="merge"):
     """
-    todo: I broke write when I consolidated note-ons and note-offs.
-    need to work note-offs back into the mix
-    :param midifile:
-    :param pattern:
+    :param midifile: path or file object
+    :param pattern: Pattern
+    :param engine: one of FileWriter.ENGINES
     :return:
     """
     if type(midifile) in (str, unicode):
         midifile = open(midifile, 'wb')
-    writer = FileWriter()
+    writer = FileWriter(engine)
     return writer.write(midifile, pattern)
 
-def read_midifile(midifile):
+def iter_midifile(midifile, raw=False, engine="buffer", note_policy="fifo", stats=None, interned=False):
+    """
+    streaming counterpart of read_midifile. Tracks are decoded as they are read rather than held in memory,
+    see FileReader.iter_events.
+    :param midifile: path or file object
+    :param raw: if True then note-on and note-off events are yielded as decoded without duration pairing
+    :param engine: one of FileReader.ENGINES
+    :param note_policy: overlapped note policy. See NotePool
+    :param stats: ParseStats to collect into or None
+    :param interned: if True then event payloads are shared tuples. See FileReader
+    :return: generator of (track_index, event)
+    """
+    reader = FileReader(engine, note_policy, stats, interned)
+    if type(midifile) in (str, unicode):
+        with open(midifile, 'rb') as midifile:
+            for item in reader.iter_events(midifile, raw):
+                yield item
+    else:
+        for item in reader.iter_events(midifile, raw):
+            yield item
+
+def _read_cached(reader, midifile, cache_dir):
+    """
+    :return: Pattern loaded from cache_dir or read and then added to cache_dir. A cache file that load_cache
+        rejects with CacheError is replaced
+    """
+    data = midifile.read()
+    policy = reader.note_policy
+    digest = hashlib.sha1(data)
+    digest.update(repr(sorted(policy.items()) if isinstance(policy, dict) else policy))
+    path = os.path.join(cache_dir, digest.hexdigest() + ".mpyc")
+    if os.path.exists(path):
+        try:
+            return load_cache(path, reader.interned)
+        except (CacheError, EnvironmentError):
+            # damaged or from another version of the format, replace it
+            pass
+    pattern = reader.read(StringIO(data))
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    save_cache(pattern, path)
+    return pattern
+
+def read_note_tables(midifile, note_policy="fifo", stats=None, interned=False):
+    """
+    :param midifile: path or file object
+    :param note_policy: overlapped note policy. See NotePool
+    :param stats: ParseStats to collect into or None
+    :param interned: if True then the payloads of events outside the note columns are shared tuples.
+        See FileReader
+    :return: Pattern of NoteTable
+    """
+    if type(midifile) in (str, unicode):
+        midifile = open(midifile, 'rb')
+    reader = FileReader(note_policy=note_policy, stats=stats, interned=interned)
+    return reader.read_tables(midifile)
+
+def read_midifile(midifile, engine="buffer", note_policy="fifo", lazy=False, workers=1, cache_dir=None, stats=None,
+                  interned=False):
+    """
+    :param midifile: path or file object
+    :param engine: one of FileReader.ENGINES
+    :param note_policy: overlapped note policy. See NotePool
+    :param lazy: if True then only chunk headers are scanned and a LazyPattern is returned
+    :param workers: number of processes to decode tracks with. None for one per cpu. Ignored if lazy
+    :param cache_dir: directory of pattern caches keyed by file content. A hit is loaded with load_cache and
+        skips parsing, and thus does not repeat warnings. Ignored if lazy
+    :param stats: ParseStats to collect into or None. Nothing is collected for a cache hit or by workers, and
+        a LazyPattern collects as its tracks are decoded
+    :param interned: if True then event payloads are tuples and equal payloads are shared between events, which
+        saves memory for controller-heavy files. See FileReader
+    :return: Pattern
+    """
     if type(midifile) in (str, unicode):
         midifile = open(midifile, 'rb')
-    reader = FileReader()
+    reader = FileReader(engine, note_policy, stats, interned)
+    if lazy:
+        return reader.read_lazy(midifile)
+    if cache_dir is not None:
+        return _read_cached(reader, midifile, cache_dir)
+    if workers!=1:
+        return reader.read_parallel(midifile, workers)
     return reader.read(midifile)
@@ -0,0 +1,212 @@
+"""
+Compact columnar form of a Track. Every event is one row across fixed-width columns and the event payloads are
+concatenated into a single byte string:
+    - offsets, durations ('l'): durations are 0 for events without one
+    - statuses ('B'): statusmsg of the event class. 0xFF for meta events
+    - metacommands ('B'): 0 for non-meta events
+    - channels ('B'): 0 for events without one
+    - sizes ('L'): length of each event's payload within data
+A packed track is a tuple of the column strings followed by data. It pickles as a handful of strings rather than
+an object graph per event.
+"""
+
+from array import array
+from struct import pack, unpack_from
+
+import os
+import sys
+
+from containers import Pattern, Track
+from events import *
+
+PACKED_COLUMNS = (("offsets", "l"), ("durations", "l"), ("statuses", "B"), ("metacommands", "B"), ("channels", "B"), ("sizes", "L"))
+
+
+def pack_track(track):
+    """
+    :param track: Track
+    :return: tuple of column strings followed by the payload string
+    """
+    columns, data = _pack_columns(track, PACKED_COLUMNS)
+    return tuple(column.tostring() for column in columns)+(data,)
+
+
+def unpack_track(packed, interned=False, payloads=None):
+    """
+    :param packed: result of pack_track
+    :param interned: if True then event payloads are shared tuples. See FileReader
+    :param payloads: dict to intern payload tuples in, so that they are shared with other tracks unpacked into
+        the same dict. Implies interned
+    :return: Track
+    """
+    if payloads is None and interned:
+        payloads = {}
+    return _unpack_columns([array(typecode, packed[index]) for index, (name, typecode) in enumerate(PACKED_COLUMNS)],
+                           PACKED_COLUMNS, packed[-1], payloads)
+
+
+def pack_pattern(pattern):
+    """
+    :param pattern: Pattern
+    :return: (format, resolution, list of packed tracks)
+    """
+    return pattern.format, pattern.resolution, [pack_track(track) for track in pattern]
+
+
+def unpack_pattern(packed, interned=False):
+    """
+    :param packed: result of pack_pattern
+    :param interned: if True then event payloads are shared tuples. See FileReader
+    :return: Pattern
+    """
+    format, resolution, tracks = packed
+    payloads = {} if interned else None
+    tracks = [_unpack_columns([array(typecode, track[index]) for index, (name, typecode) in enumerate(PACKED_COLUMNS)],
+                              PACKED_COLUMNS, track[-1], payloads) for track in tracks]
+    return Pattern(resolution=resolution, format=format, tracks=tracks)
+
+
+"""
+Pattern cache file. Little-endian, with every column at an offset that is a multiple of its item size so that the
+file can be mapped and read in place:
+    - header "<4sHHHHxxxx": CACHE_MAGIC, CACHE_VERSION, format, resolution, track count
+    - track table, one "<IIQ" per track: event count, payload size, file offset of the track's section
+    - track sections, each starting on an 8 byte boundary: the CACHE_COLUMNS arrays in order followed by the payload
+"""
+CACHE_MAGIC = "MPYC"
+CACHE_VERSION = 1
+CACHE_COLUMNS = (("offsets", "i"), ("durations", "i"), ("sizes", "I"), ("statuses", "B"), ("metacommands", "B"), ("channels", "B"))
+CACHE_HEADER = "<4sHHHHxxxx"
+CACHE_TRACK = "<IIQ"
+
+
+class CacheError(TypeError):
+    """
+    raised by load_cache for a file that is not a complete pattern cache of CACHE_VERSION
+    """
+    pass
+
+
+def save_cache(pattern, path):
+    """
+    writes pattern to path in the cache format. The file is written aside and renamed into place.
+    :param pattern: Pattern
+    :param path: file path
+    """
+    sections = []
+    position = 16+16*len(pattern)
+    table = [pack(CACHE_HEADER, CACHE_MAGIC, CACHE_VERSION, pattern.format, pattern.resolution, len(pattern))]
+    for track in pattern:
+        columns, data = _pack_columns(track, CACHE_COLUMNS)
+        if sys.byteorder=="big":
+            for column in columns:
+                column.byteswap()
+        section = ''.join(column.tostring() for column in columns)+data
+        section += '\0'*(-len(section)%8)
+        table.append(pack(CACHE_TRACK, len(track), len(data), position))
+        sections.append(section)
+        position += len(section)
+    temp = "%s.%d.tmp" % (path, os.getpid())
+    with open(temp, 'wb') as cachefile:
+        cachefile.write(''.join(table))
+        cachefile.write(''.join(sections))
+    os.rename(temp, path)
+
+
+def load_cache(path, interned=False):
+    """
+    :param path: file written by save_cache
+    :param interned: if True then event payloads are shared tuples. See FileReader
+    :return: Pattern
+    :raises CacheError: if the file is truncated, damaged or of another version
+    """
+    with open(path, 'rb') as cachefile:
+        blob = cachefile.read()
+    if len(blob) < 16:
+        raise CacheError, "Truncated pattern cache header."
+    magic, version, format, resolution, ntracks = unpack_from(CACHE_HEADER, blob)
+    if magic != CACHE_MAGIC:
+        raise CacheError, "Bad header in pattern cache."
+    if version != CACHE_VERSION:
+        raise CacheError, "Unsupported pattern cache version: " + str(version)
+    if len(blob) < 16+16*ntracks:
+        raise CacheError, "Truncated pattern cache track table."
+    tracks = []
+    payloads = {} if interned else None
+    for index in xrange(ntracks):
+        count, size, position = unpack_from(CACHE_TRACK, blob, 16+16*index)
+        columns = []
+        for name, typecode in CACHE_COLUMNS:
+            column = array(typecode)
+            end = position+count*column.itemsize
+            if end > len(blob):
+                raise CacheError, "Truncated pattern cache track: " + str(index)
+            column.fromstring(blob[position:end])
+            if sys.byteorder=="big":
+                column.byteswap()
+            columns.append(column)
+            position = end
+        sizes = columns[[name for name, typecode in CACHE_COLUMNS].index("sizes")]
+        if position+size > len(blob) or sum(sizes) != size:
+            raise CacheError, "Truncated pattern cache track: " + str(index)
+        try:
+            tracks.append(_unpack_columns(columns, CACHE_COLUMNS, blob[position:position+size], payloads))
+        except (KeyError, ValueError, IndexError):
+            # a status byte or payload that no event can be built from
+            raise CacheError, "Damaged pattern cache track: " + str(index)
+    return Pattern(resolution=resolution, format=format, tracks=tracks)
+
+
+def _pack_columns(track, layout):
+    """
+    :param track: Track
+    :param layout: sequence of (column name, array typecode)
+    :return: (list of arrays in layout order, payload string)
+    """
+    columns = dict((name, array(typecode)) for name, typecode in layout)
+    data = bytearray()
+    for event in track:
+        columns["offsets"].append(event.offset)
+        columns["durations"].append(getattr(event, "duration", 0))
+        columns["statuses"].append(event.statusmsg)
+        columns["metacommands"].append(getattr(event, "metacommand", None) or 0)
+        columns["channels"].append(getattr(event, "channel", 0))
+        columns["sizes"].append(len(event.data))
+        data.extend(event.data)
+    return [columns[name] for name, typecode in layout], str(data)
+
+
+def _unpack_columns(columns, layout, data, payloads=None):
+    """
+    :param columns: list of arrays in layout order
+    :param layout: sequence of (column name, array typecode)
+    :param data: payload string
+    :param payloads: dict to intern payload tuples in or None for payload lists
+    :return: Track
+    """
+    columns = dict((name, column) for (name, typecode), column in zip(layout, columns))
+    offsets, durations, statuses, metacommands, channels, sizes = [columns[name] for name in
+        ("offsets", "durations", "statuses", "metacommands", "channels", "sizes")]
+    data = bytearray(data)
+    events = []
+    position = 0
+    for index in xrange(len(offsets)):
+        end = position+sizes[index]
+        if payloads is None:
+            payload = list(data[position:end])
+        else:
+            payload = tuple(data[position:end])
+            payload = payloads.setdefault(payload, payload)
+        position = end
+        status = statuses[index]
+        if status==MetaEvent.statusmsg:
+            metacommand = metacommands[index]
+            cls = EventRegistry.MetaEvents.get(metacommand, UnknownMetaEvent)
+            events.append(cls.from_raw(offsets[index], payload, metacommand))
+        elif status==SysexEvent.statusmsg:
+            events.append(SysexEvent.from_raw(offsets[index], payload))
+        elif status==NoteOnEvent.statusmsg:
+            events.append(NoteOnEvent.from_raw(offsets[index], payload, channels[index], durations[index]))
+        else:
+            events.append(EventRegistry.Events[status].from_raw(offsets[index], payload, channels[index]))
+    return Track(events)
@@ -0,0 +1,83 @@
+import multiprocessing
+import warnings
+
+from fileio import ParseStats, read_midifile
+from packed import pack_pattern, unpack_pattern
+
+
+class LoadResult(object):
+    """
+    outcome of loading one file with read_midifiles
+        - path: as passed in
+        - pattern: Pattern or None if loading failed
+        - warnings: list of warning messages raised while loading
+        - error: description of the exception that stopped loading or None
+        - stats: ParseStats if requested, otherwise None
+    """
+    __slots__ = ['path', 'pattern', 'warnings', 'error', 'stats']
+
+    def __init__(self, path, pattern=None, warnings=None, error=None, stats=None):
+        self.path = path
+        self.pattern = pattern
+        self.warnings = warnings or []
+        self.error = error
+        self.stats = stats
+
+    def __repr__(self):
+        return "midi.LoadResult(path=%r, error=%r, warnings=%r)" % (self.path, self.error, len(self.warnings))
+
+
+def read_midifiles(paths, workers=None, stats=False, **kwargs):
+    """
+    loads many files across a pool of processes. Patterns come back from the workers packed (see packed.py)
+    rather than as pickled events. A failure in one file is recorded in its result and does not stop the batch.
+    :param paths: sequence of paths
+    :param workers: number of processes. None for one per cpu, 1 to load in this process
+    :param stats: if True then each file is read with its own ParseStats
+    :param kwargs: passed on to read_midifile
+    :return: list of LoadResult in the order of paths
+    """
+    jobs = [(path, kwargs, stats) for path in paths]
+    if workers==1 or len(jobs)<2:
+        return [LoadResult(path, *_load(job)) for path, job in zip(paths, jobs)]
+    pool = multiprocessing.Pool(workers)
+    try:
+        loaded = pool.map(_load_packed, jobs, chunksize=max(1, len(jobs)//(4*(workers or multiprocessing.cpu_count()))))
+    finally:
+        pool.close()
+        pool.join()
+    results = []
+    for path, (packed, messages, error, collected) in zip(paths, loaded):
+        pattern = unpack_pattern(packed, kwargs.get("interned", False)) if packed is not None else None
+        results.append(LoadResult(path, pattern, messages, error, collected))
+    return results
+
+
+def _load(job, pack=False):
+    """
+    :param job: (path, read_midifile kwargs, whether to collect ParseStats)
+    :param pack: whether to return the pattern packed
+    :return: (pattern or None, warning messages, error or None, ParseStats or None)
+    """
+    path, kwargs, stats = job
+    pattern, error = None, None
+    stats = ParseStats() if stats else None
+    if stats is not None:
+        kwargs = dict(kwargs, stats=stats)
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        try:
+            with open(path, 'rb') as midifile:
+                pattern = read_midifile(midifile, **kwargs)
+            if pack:
+                pattern = pack_pattern(pattern)
+        except Exception as exception:
+            error = "%s: %s" % (exception.__class__.__name__, exception)
+    return pattern, [str(warning.message) for warning in caught], error, stats
+
+
+def _load_packed(job):
+    """
+    worker side of read_midifiles
+    """
+    return _load(job, True)
@@ -0,0 +1,404 @@
+"""
+Playback of a Pattern against a clock. The tracks are merged by offset, note-ons are expanded into note-on and
+note-off messages and each message is handed to a sink once it is due.
+"""
+
+from bisect import bisect_left
+
+import heapq
+import itertools
+import math
+import threading
+import time
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+
+from containers import TickConverter
+from events import *
+
+_monotonic = getattr(time, "monotonic", time.time)
+
+
+class Sink(object):
+    """
+    output of a Sequencer. Subclasses implement send.
+    """
+
+    def send(self, event, track, due):
+        """
+        :param event: event to output now. Note-offs are generated from the durations of note-ons
+        :param track: index of the event's track
+        :param due: clock time the event was scheduled for
+        """
+        raise NotImplementedError
+
+
+class FakeSink(Sink):
+    """
+    sink for tests that records what it is sent
+        - sent: list of (due, track, event)
+    """
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, event, track, due):
+        self.sent.append((due, track, event))
+
+
+class FakeClock(object):
+    """
+    clock for tests. Time only moves on sleep, which overshoots by latency.
+    """
+
+    def __init__(self, start=0.0, latency=0.0):
+        self.now = start
+        self.latency = latency
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += max(seconds, 0)+self.latency
+
+
+class PlaybackStats(object):
+    """
+    lateness of dispatched events in seconds:
+        - events: events dispatched
+        - late_events: events dispatched more than late_threshold after they were due
+        - max_lateness
+        - mean_lateness
+        - jitter: standard deviation of lateness
+    """
+
+    def __init__(self, late_threshold=0.005):
+        self.late_threshold = late_threshold
+        self.events = 0
+        self.late_events = 0
+        self.max_lateness = 0.0
+        self.mean_lateness = 0.0
+        self._m2 = 0.0
+
+    #--- public api ---#
+    def get_jitter(self):
+        return math.sqrt(self._m2/self.events) if self.events else 0.0
+    jitter = property(get_jitter)
+
+    def record(self, lateness):
+        self.events += 1
+        if lateness > self.late_threshold:
+            self.late_events += 1
+        self.max_lateness = max(self.max_lateness, lateness)
+        delta = lateness-self.mean_lateness
+        self.mean_lateness += delta/self.events
+        self._m2 += delta*(lateness-self.mean_lateness)
+
+    def as_dict(self):
+        """
+        :return: dict of the statistics suitable for JSON
+        """
+        return dict((name, getattr(self, name)) for name in
+                    ("events", "late_events", "late_threshold", "max_lateness", "mean_lateness", "jitter"))
+
+    #--- private api ---#
+    def __repr__(self):
+        return "midi.PlaybackStats(events=%r, late_events=%r, jitter=%r)" % (self.events, self.late_events, self.jitter)
+
+
+class Sequencer(object):
+    """
+    plays a Pattern into a sink. Events are scheduled against absolute clock times worked out from where
+    playback was last anchored, so time spent sending or oversleeping does not accumulate. The pattern is merged
+    when the sequencer is created and later changes to it are not followed.
+    """
+
+    def __init__(self, pattern, sink, clock=None, sleep=None, late_threshold=0.005):
+        """
+        :param pattern: Pattern
+        :param sink: Sink or any object with its send method
+        :param clock: function returning monotonic seconds. Ignored by play_async, which uses the loop's clock
+        :param sleep: function sleeping for a number of seconds. The default wakes up early on stop, seek and
+            tempo scale changes
+        :param late_threshold: see PlaybackStats
+        """
+        self.sink = sink
+        self.clock = clock or _monotonic
+        self.sleep = sleep or self._wait
+        self.stats = PlaybackStats(late_threshold)
+        self._converter = self._tick_converter(pattern)
+        self._offsets, self._events = [], []
+        for offset, track, event in merge_playback(pattern):
+            self._offsets.append(offset)
+            self._events.append((track, event))
+        self._seconds = self._converter.offsets_to_seconds(self._offsets)
+        self._index = 0
+        self._tempo_scale = 1.0
+        self._loop = None
+        self._sounding = {}
+        # (clock time, pattern seconds) playback is measured from. The clock time is None while stopped.
+        self._anchor = (None, 0.0)
+        self._lock = threading.RLock()
+        self._wakeup = threading.Event()
+        self._reschedule = self._wakeup.set
+        self._clock = self.clock
+        self._playing = False
+
+    #--- public api ---#
+    def get_tempo_scale(self):
+        return self._tempo_scale
+    def set_tempo_scale(self, scale):
+        """
+        :param scale: playback speed relative to the tempo map, 2.0 for twice as fast
+        """
+        if scale <= 0:
+            raise ValueError, "Tempo scale must be positive: " + str(scale)
+        with self._lock:
+            self._reanchor(self._position_seconds())
+            self._tempo_scale = float(scale)
+        self._reschedule()
+    tempo_scale = property(get_tempo_scale, set_tempo_scale)
+
+    def get_position(self):
+        """
+        :return: current position in ticks
+        """
+        with self._lock:
+            return self._converter.seconds_to_offset(self._position_seconds())
+    position = property(get_position)
+
+    def is_playing(self):
+        return self._playing
+
+    def seek(self, offset):
+        """
+        moves playback to offset. Sounding notes are stopped and notes that started before offset are not played.
+        :param offset: position in ticks
+        """
+        with self._lock:
+            self._silence()
+            self._index = bisect_left(self._offsets, offset)
+            self._reanchor(self._converter.offset_to_seconds(offset))
+        self._reschedule()
+
+    def set_loop(self, start=None, end=None, count=None):
+        """
+        repeats [start, end) once playback reaches end
+        :param start: loop start in ticks or None to clear the loop
+        :param end: loop end in ticks
+        :param count: number of times to jump back to start or None to loop until stopped
+        """
+        with self._lock:
+            if start is None:
+                self._loop = None
+            elif end is None or end <= start:
+                raise ValueError, "Loop end must follow its start: " + str((start, end))
+            else:
+                self._loop = [start, end, count]
+        self._reschedule()
+
+    def play(self):
+        """
+        plays from the current position in this thread until the end of the pattern or stop()
+        """
+        self._start(self.clock)
+        try:
+            while True:
+                due = self._dispatch(self._clock())
+                if due is None:
+                    break
+                self.sleep(max(due-self._clock(), 0))
+        finally:
+            self._finish()
+
+    def play_async(self, loop=None):
+        """
+        counterpart of play for an asyncio event loop. Every wakeup is scheduled with loop.call_at on the loop's
+        clock, so the sequencer shares the loop's thread and must only be controlled from it.
+        :param loop: event loop or None for asyncio.get_event_loop()
+        :return: future resolved once playback ends
+        """
+        if loop is None:
+            if asyncio is None:
+                raise ImportError("Sequencer.play_async requires asyncio")
+            loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        handle = [None]
+
+        def _wake():
+            try:
+                due = self._dispatch(loop.time())
+            except Exception as exception:
+                self._finish()
+                future.set_exception(exception)
+                return
+            if due is None:
+                self._finish()
+                future.set_result(self.stats)
+            else:
+                handle[0] = loop.call_at(due, _wake)
+
+        def _reschedule():
+            if handle[0] is not None:
+                handle[0].cancel()
+            handle[0] = loop.call_soon(_wake)
+
+        self._start(loop.time)
+        self._reschedule = _reschedule
+        _reschedule()
+        return future
+
+    def stop(self):
+        """
+        stops playback, sounding notes included. play resumes from the position playback stopped at.
+        """
+        with self._lock:
+            self._playing = False
+        self._reschedule()
+
+    #--- private api ---#
+    @staticmethod
+    def _tick_converter(pattern):
+        tempos = [event for track in pattern for event in track.events_of(SetTempoEvent)]
+        return TickConverter(tempos, pattern.resolution)
+
+    def _start(self, clock):
+        with self._lock:
+            if self._playing:
+                raise RuntimeError, "Sequencer is already playing"
+            self._clock = clock
+            self._playing = True
+            self._wakeup.clear()
+            self._anchor = (clock(), self._anchor[1])
+
+    def _finish(self):
+        with self._lock:
+            self._silence()
+            self._anchor = (None, self._position_seconds())
+            self._playing = False
+            self._reschedule = self._wakeup.set
+
+    def _dispatch(self, now):
+        """
+        sends every event that is due at now
+        :return: clock time the next event is due or None once playback has ended
+        """
+        with self._lock:
+            count = len(self._offsets)
+            while self._playing:
+                loop = self._loop
+                if loop is not None and (self._index >= count or self._offsets[self._index] >= loop[1]):
+                    due = self._due(self._converter.offset_to_seconds(loop[1]))
+                    if due > now:
+                        return due
+                    self._wrap(due)
+                    continue
+                if self._index >= count:
+                    return None
+                due = self._due(self._seconds[self._index])
+                if due > now:
+                    return due
+                track, event = self._events[self._index]
+                self._index += 1
+                if self._sound(event, track):
+                    self.stats.record(now-due)
+                    self.sink.send(event, track, due)
+            return None
+
+    def _sound(self, event, track):
+        """
+        keeps track of sounding notes
+        :return: whether event should be sent. Note-offs of notes that were not played are dropped.
+        """
+        if isinstance(event, NoteOnEvent):
+            key = (track, event.channel, event.data[0])
+            self._sounding[key] = self._sounding.get(key, 0)+1
+        elif isinstance(event, NoteOffEvent):
+            key = (track, event.channel, event.data[0])
+            if not self._sounding.get(key):
+                return False
+            self._sounding[key] -= 1
+            if not self._sounding[key]:
+                del self._sounding[key]
+        return True
+
+    def _silence(self, offset=None, due=None):
+        """
+        sends note-offs for every sounding note
+        :param offset: offset of the note-offs or None for the current position
+        :param due: clock time the note-offs are sent for or None for now
+        """
+        if offset is None:
+            offset = self._converter.seconds_to_offset(self._position_seconds())
+        if due is None and self._anchor[0] is not None:
+            due = self._clock()
+        for (track, channel, pitch), count in sorted(self._sounding.iteritems()):
+            for index in xrange(count):
+                self.sink.send(NoteOffEvent.from_raw(offset, [pitch, 0], channel), track, due)
+        self._sounding.clear()
+
+    def _wrap(self, due):
+        """
+        jumps back to the loop start at clock time due
+        """
+        loop = self._loop
+        self._silence(loop[1], due)
+        if loop[2] is not None:
+            loop[2] -= 1
+            if loop[2] <= 0:
+                self._loop = None
+        self._index = bisect_left(self._offsets, loop[0])
+        self._anchor = (due, self._converter.offset_to_seconds(loop[0]))
+
+    def _due(self, seconds):
+        """
+        :param seconds: position in pattern seconds
+        :return: clock time of seconds
+        """
+        clock, anchor = self._anchor
+        return clock+(seconds-anchor)/self._tempo_scale
+
+    def _position_seconds(self):
+        clock, anchor = self._anchor
+        if clock is None:
+            return anchor
+        return anchor+max(self._clock()-clock, 0)*self._tempo_scale
+
+    def _reanchor(self, seconds):
+        self._anchor = (self._clock() if self._anchor[0] is not None else None, seconds)
+
+    def _wait(self, seconds):
+        self._wakeup.wait(seconds)
+        self._wakeup.clear()
+
+
+def merge_playback(pattern):
+    """
+    k-way merge of the tracks of pattern by offset. Every note-on is followed by a note-off at the end of its
+    duration. At equal offsets note-offs come first, otherwise ties keep track order.
+    :param pattern: Pattern of tracks in offset order
+    :return: list of (offset, track index, event)
+    """
+    sequence = itertools.count()
+    iterators = [iter(track) for track in pattern]
+    heap = []
+    for index, events in enumerate(iterators):
+        event = next(events, None)
+        if event is not None:
+            heap.append((event.offset, 1, index, next(sequence), event))
+    heapq.heapify(heap)
+    result = []
+    while heap:
+        offset, order, index, position, event = heapq.heappop(heap)
+        result.append((offset, index, event))
+        if order:
+            if isinstance(event, NoteOnEvent):
+                end = offset+event.duration
+                heapq.heappush(heap, (end, 0, index, next(sequence), NoteOffEvent.from_raw(end, event.data, event.channel)))
+            event = next(iterators[index], None)
+            if event is not None:
+                heapq.heappush(heap, (event.offset, 1, index, next(sequence), event))
+    return result
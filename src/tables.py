@@ -0,0 +1,134 @@
+from array import array
+
+import bisect
+import heapq
+import operator
+
+from containers import Track
+from events import NoteOnEvent
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class NoteTable(object):
+    """
+    columnar representation of a track. Notes are stored one row per note in array columns:
+        - offsets, durations: ticks
+        - channels, pitches, velocities
+    All other events are kept as objects in a Track in `events`, and `event_rows` holds the number of notes
+    that came before each of them so that to_track can restore the original order.
+    """
+    COLUMNS = (("offsets", "l"), ("durations", "l"), ("channels", "B"), ("pitches", "B"), ("velocities", "B"))
+
+    def __init__(self):
+        for name, typecode in self.COLUMNS:
+            setattr(self, name, array(typecode))
+        self.events = Track()
+        self.event_rows = array('l')
+
+    #--- public api ---#
+    def get_duration(self):
+        result = max([event.offset+getattr(event, "duration", 0) for event in self.events] or [0])
+        if len(self.offsets)>0:
+            result = max(result, max(map(operator.add, self.offsets, self.durations)))
+        return result
+    duration = property(get_duration)
+
+    def append_note(self, offset, duration, channel, pitch, velocity):
+        """
+        :return: row index of the note
+        """
+        self.offsets.append(offset)
+        self.durations.append(duration)
+        self.channels.append(channel)
+        self.pitches.append(pitch)
+        self.velocities.append(velocity)
+        return len(self.offsets)-1
+
+    def append_event(self, event):
+        """
+        :param event: event that is not a note, following the notes appended so far
+        """
+        self.events.append(event)
+        self.event_rows.append(len(self.offsets))
+
+    def note(self, index):
+        """
+        :param index: row index
+        :return: NoteOnEvent built from the row
+        """
+        return NoteOnEvent.from_raw(self.offsets[index], [self.pitches[index], self.velocities[index]],
+                                    self.channels[index], self.durations[index])
+
+    def compact(self, rows):
+        """
+        removes rows in a single pass
+        :param rows: collection of row indices to remove
+        """
+        rows = set(rows)
+        if rows:
+            keep = [index for index in xrange(len(self.offsets)) if index not in rows]
+            for name, typecode in self.COLUMNS:
+                column = getattr(self, name)
+                setattr(self, name, array(typecode, [column[index] for index in keep]))
+            removed = sorted(rows)
+            self.event_rows = array('l', [row-bisect.bisect_left(removed, row) for row in self.event_rows])
+
+    def events_of(self, cls):
+        """
+        :param cls: event class. Subclasses are not included
+        :return: list of the events of exactly class cls kept in `events`, see Track.events_of. Notes held in
+            the columns are not included
+        """
+        return self.events.events_of(cls)
+
+    def to_track(self):
+        """
+        merges notes and events by offset. At equal offsets events keep their place among the notes as given by
+        event_rows. Events added to `events` directly rather than through append_event sort ahead of the notes.
+        :return: Track
+        """
+        rows = self.event_rows
+        notes = ((self.offsets[index], index, 1, index) for index in xrange(len(self.offsets)))
+        events = ((event.offset, rows[index] if index<len(rows) else 0, 0, index) for index, event in enumerate(self.events))
+        track = Track()
+        for offset, row, is_note, index in heapq.merge(events, notes):
+            track.append(self.note(index) if is_note else self.events[index])
+        return track
+
+    def to_numpy(self):
+        """
+        :return: dict of column name to numpy array
+        :raises ImportError: if numpy is not installed
+        """
+        if numpy is None:
+            raise ImportError("NoteTable.to_numpy requires numpy")
+        return dict((name, numpy.array(getattr(self, name))) for name, typecode in self.COLUMNS)
+
+    @classmethod
+    def from_track(cls, track):
+        table = cls()
+        for event in track:
+            if isinstance(event, NoteOnEvent):
+                table.append_note(event.offset, event.duration, event.channel, event.data[0], event.data[1])
+            else:
+                table.append_event(event)
+        return table
+
+    #--- private api ---#
+    def _get_tempo_revision(self):
+        return self.events._tempo_revision
+    # lets Pattern.get_tick_converter cache the tempo map of a pattern of tables
+    _tempo_revision = property(_get_tempo_revision)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        return iter(self.to_track())
+
+    def __repr__(self):
+        return "midi.NoteTable(notes=%r, events=%r)" % (len(self), len(self.events))
@@ -0,0 +1,311 @@
+"""
+Edits applied to whole patterns, tracks or note columns. Transforms are composed into a Pipeline, which applies
+all of them to each event in a single pass over a track. Events are modified in place unless the pipeline is
+applied with copy=True, which copies each event as it is reached and leaves the original alone.
+"""
+
+from array import array
+
+from containers import Pattern, Track, nearest_quantized_duration
+from tables import NoteTable
+from events import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class Transform(object):
+    """
+    one step of a Pipeline. Subclasses implement bind and apply_columns.
+    """
+
+    def bind(self, resolution):
+        """
+        :param resolution: resolution in effect when this step runs
+        :return: function that edits an event in place or None if this step never changes events
+        """
+        raise NotImplementedError
+
+    def apply_columns(self, columns, resolution):
+        """
+        :param columns: dict of column name to array.array or numpy array as named in NoteTable.COLUMNS. Missing
+            columns are skipped. Edited columns are replaced in the dict.
+        :param resolution: resolution in effect when this step runs
+        """
+        raise NotImplementedError
+
+    def get_resolution(self, resolution):
+        """
+        :return: resolution once this step has run
+        """
+        return resolution
+
+
+class Transpose(Transform):
+    """
+    shifts the pitch of note and after touch events, clamped to 0-127
+    """
+
+    def __init__(self, semitones):
+        self.semitones = semitones
+        self._table = [min(max(pitch+semitones, 0), 127) for pitch in xrange(128)]
+
+    def bind(self, resolution):
+        table = self._table
+        def _transpose(event):
+            if isinstance(event, (NoteEvent, AfterTouchEvent)):
+                event.pitch = table[event.pitch]
+        return _transpose
+
+    def apply_columns(self, columns, resolution):
+        if "pitches" in columns:
+            columns["pitches"] = _lookup(columns["pitches"], self._table)
+
+
+class Velocity(Transform):
+    """
+    maps note-on velocities through curve, or scales and shifts them. Results are clamped to 1-127 so that no
+    note-on turns into a note-off.
+    """
+
+    def __init__(self, factor=1.0, offset=0, curve=None):
+        """
+        :param factor: multiplier
+        :param offset: added after multiplying
+        :param curve: function of velocity to velocity used instead of factor and offset
+        """
+        if curve is None:
+            curve = lambda velocity: velocity*factor+offset
+        self._table = [min(max(int(round(curve(velocity))), 1), 127) for velocity in xrange(128)]
+
+    def bind(self, resolution):
+        table = self._table
+        def _velocity(event):
+            if isinstance(event, NoteOnEvent):
+                event.velocity = table[event.velocity]
+        return _velocity
+
+    def apply_columns(self, columns, resolution):
+        if "velocities" in columns:
+            columns["velocities"] = _lookup(columns["velocities"], self._table)
+
+
+class Stretch(Transform):
+    """
+    multiplies offsets by numerator/denominator. Ends of notes are scaled and rounded, not durations, so notes
+    that abut before abut after.
+    """
+
+    def __init__(self, numerator, denominator=1):
+        self.numerator = numerator
+        self.denominator = denominator
+
+    def get_ratio(self, resolution):
+        """
+        :return: (numerator, denominator) at resolution
+        """
+        return self.numerator, self.denominator
+
+    def bind(self, resolution):
+        numerator, denominator = self.get_ratio(resolution)
+        half = denominator//2
+        def _stretch(event):
+            offset = event.offset
+            event.offset = (offset*numerator+half)//denominator
+            if isinstance(event, NoteOnEvent):
+                event.duration = ((offset+event.duration)*numerator+half)//denominator-event.offset
+        return _stretch
+
+    def apply_columns(self, columns, resolution):
+        if "offsets" not in columns:
+            return
+        numerator, denominator = self.get_ratio(resolution)
+        half = denominator//2
+        offsets, durations = columns["offsets"], columns.get("durations")
+        if numpy is not None and isinstance(offsets, numpy.ndarray):
+            columns["offsets"] = (offsets*numerator+half)//denominator
+            if durations is not None:
+                columns["durations"] = ((offsets+durations)*numerator+half)//denominator-columns["offsets"]
+            return
+        columns["offsets"] = array(offsets.typecode, [(offset*numerator+half)//denominator for offset in offsets])
+        if durations is not None:
+            columns["durations"] = array(durations.typecode, [((offset+duration)*numerator+half)//denominator-scaled
+                for offset, duration, scaled in zip(offsets, durations, columns["offsets"])])
+
+
+class Rescale(Stretch):
+    """
+    converts ticks to another resolution. Pipeline.apply_pattern sets the pattern's resolution to match.
+    """
+
+    def __init__(self, resolution):
+        self.resolution = resolution
+
+    def get_ratio(self, resolution):
+        if resolution is None:
+            raise ValueError, "Rescale needs the resolution of the events"
+        return self.resolution, resolution
+
+    def get_resolution(self, resolution):
+        return self.resolution
+
+
+class Quantize(Transform):
+    """
+    rounds note durations with nearest_quantized_duration and optionally snaps offsets to a grid
+    """
+
+    def __init__(self, durations=True, grid=None):
+        """
+        :param durations: whether to quantize note durations
+        :param grid: ticks to snap offsets to the nearest multiple of or None to leave offsets
+        """
+        self.durations = durations
+        self.grid = grid
+
+    def bind(self, resolution):
+        if self.durations and resolution is None:
+            raise ValueError, "Quantize needs the resolution of the events"
+        durations, grid = self.durations, self.grid
+        def _quantize(event):
+            if grid:
+                event.offset = (event.offset+grid//2)//grid*grid
+            if durations and isinstance(event, NoteOnEvent):
+                event.duration = nearest_quantized_duration(resolution, event.duration)
+        return _quantize
+
+    def apply_columns(self, columns, resolution):
+        if self.grid and "offsets" in columns:
+            grid = self.grid
+            columns["offsets"] = _map(columns["offsets"], lambda offset: (offset+grid//2)//grid*grid)
+        if self.durations and "durations" in columns:
+            if resolution is None:
+                raise ValueError, "Quantize needs the resolution of the events"
+            columns["durations"] = _map(columns["durations"], lambda duration: nearest_quantized_duration(resolution, duration))
+
+
+class Pipeline(object):
+    """
+    transforms applied in order. All transforms are applied to an event before moving on to the next.
+    Transforms are expected to keep offsets in order, tracks are not re-sorted.
+    """
+
+    def __init__(self, *transforms):
+        self.transforms = list(transforms)
+
+    #--- public api ---#
+    def then(self, transform):
+        """
+        :return: new Pipeline with transform appended
+        """
+        return Pipeline(*(self.transforms+[transform]))
+
+    def get_resolution(self, resolution):
+        """
+        :return: resolution once every transform has run
+        """
+        for transform in self.transforms:
+            resolution = transform.get_resolution(resolution)
+        return resolution
+
+    def apply_pattern(self, pattern, copy=False):
+        """
+        :param pattern: Pattern of Track or NoteTable
+        :param copy: if True then pattern is left alone and a copy is edited, see apply_track
+        :return: pattern, edited in place and with its resolution updated, or the edited copy
+        """
+        tracks = [self.apply_track(track, pattern.resolution, copy) if isinstance(track, Track) else
+                  self.apply_table(track, pattern.resolution, copy) for track in pattern]
+        if copy:
+            pattern = Pattern(resolution=pattern.resolution, format=pattern.format, tracks=tracks)
+        pattern.resolution = self.get_resolution(pattern.resolution)
+        return pattern
+
+    def apply_track(self, track, resolution=None, copy=False):
+        """
+        :param track: Track
+        :param resolution: resolution of track. Required by Rescale and Quantize
+        :param copy: if True then track is left alone and its events are cloned as they are reached, which
+            saves cloning the track in a pass of its own
+        :return: track, edited in place, or the edited copy
+        """
+        functions = filter(None, self._bind(resolution))
+        if copy:
+            events = []
+            for event in track:
+                event = event.clone()
+                for function in functions:
+                    function(event)
+                events.append(event)
+            return Track(events)
+        if functions:
+            for event in track:
+                for function in functions:
+                    function(event)
+        track.invalidate()
+        return track
+
+    def apply_columns(self, columns, resolution=None):
+        """
+        :param columns: see Transform.apply_columns
+        :param resolution: resolution of the columns. Required by Rescale and Quantize
+        :return: columns
+        """
+        for transform in self.transforms:
+            transform.apply_columns(columns, resolution)
+            resolution = transform.get_resolution(resolution)
+        return columns
+
+    def apply_table(self, table, resolution=None, copy=False):
+        """
+        applies the transforms to the note columns of a NoteTable and to its other events
+        :param table: NoteTable
+        :param resolution: resolution of table. Required by Rescale and Quantize
+        :param copy: if True then table is left alone and a copy is edited
+        :return: table, edited in place, or the edited copy
+        """
+        if copy:
+            source, table = table, NoteTable()
+            for name, typecode in table.COLUMNS:
+                setattr(table, name, array(typecode, getattr(source, name)))
+            table.event_rows = array('l', source.event_rows)
+            table.events = source.events
+        columns = self.apply_columns(dict((name, getattr(table, name)) for name, typecode in table.COLUMNS),
+                                     resolution)
+        for name, typecode in table.COLUMNS:
+            setattr(table, name, columns[name])
+        table.events = self.apply_track(table.events, resolution, copy)
+        return table
+
+    #--- private api ---#
+    def _bind(self, resolution):
+        functions = []
+        for transform in self.transforms:
+            functions.append(transform.bind(resolution))
+            resolution = transform.get_resolution(resolution)
+        return functions
+
+
+def _lookup(column, table):
+    """
+    :return: column with every value v replaced by table[v]
+    """
+    if numpy is not None and isinstance(column, numpy.ndarray):
+        return numpy.array(table, dtype=column.dtype)[column]
+    return array(column.typecode, [table[value] for value in column])
+
+
+def _map(column, function):
+    """
+    :return: column with every value v replaced by function(v). function is called once per distinct value
+    """
+    if numpy is not None and isinstance(column, numpy.ndarray):
+        values, inverse = numpy.unique(column, return_inverse=True)
+        return numpy.array([function(value) for value in values], dtype=column.dtype)[inverse]
+    results = {}
+    for value in column:
+        if value not in results:
+            results[value] = function(value)
+    return array(column.typecode, [results[value] for value in column])
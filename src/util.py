@@ -8,6 +8,26 @@ def read_varlen(data):
         if not (chr&0x80):
             return value
 
+def read_varlen_at(data, pos):
+    """
+    buffer counterpart of read_varlen
+    :param data: bytearray
+    :param pos: index of the first byte of the varlen
+    :return: (value, index of the byte following the varlen)
+    """
+    chr=data[pos]
+    if not (chr&0x80):
+        return chr, pos+1
+    value=chr&0x7f
+    while True:
+        pos+=1
+        chr=data[pos]
+        # shift last value up 7 bits and add masked chr
+        value=(value<<7) + (chr&0x7f)
+        # is the hi-bit set?
+        if not (chr&0x80):
+            return value, pos+1
+
 def write_varlen(value):
     chr1=chr(value&0x7F)
     value>>=7
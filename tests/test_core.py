@@ -1,7 +1,16 @@
 from __future__ import division
 
 import copy
+import gc
+import os
+import random
+import shutil
+import struct
+import tempfile
 import unittest
+from StringIO import StringIO
+import warnings
+import weakref
 import midi
 
 
@@ -13,6 +22,14 @@ class TestUtil(unittest.TestCase):
             outval = midi.read_varlen(iter(datum))
             self.assertEqual(inval, outval)
 
+    def test_varlen_at(self):
+        maxval = 0x0FFFFFFF
+        for inval in xrange(0, maxval, int(maxval / 1000)):
+            datum = bytearray("\x00" + midi.write_varlen(inval) + "\x00")
+            outval, pos = midi.read_varlen_at(datum, 1)
+            self.assertEqual(inval, outval)
+            self.assertEqual(pos, len(datum)-1)
+
 
 class TestEvents(unittest.TestCase):
     def test_note_on(self):
@@ -33,10 +50,32 @@ class TestEvents(unittest.TestCase):
         self.assertEqual(event.duration, clone.duration)
         self.assertListEqual(event.data, clone.data)
 
+    def test_deepcopy_meta(self):
+        for event in (midi.TrackNameEvent(offset=1, text="abc"), midi.UnknownMetaEvent(offset=2, data=[1], metacommand=0x60)):
+            clone=copy.deepcopy(event)
+            self.assertEqual(clone.__class__, event.__class__)
+            self.assertEqual(repr(clone), repr(event))
+            self.assertEqual(clone.metacommand, event.metacommand)
+
     def test_meta_event_with_text(self):
         event=midi.TextMetaEvent(text="abc")
         self.assertListEqual(event.data, [97, 98, 99])
 
+    def test_from_raw(self):
+        pairs=[
+            (midi.NoteOnEvent.from_raw(5, [60, 64], 2, 10), midi.NoteOnEvent(offset=5, data=[60, 64], channel=2, duration=10)),
+            (midi.NoteOffEvent.from_raw(5, [60, 0], 2), midi.NoteOffEvent(offset=5, data=[60, 0], channel=2)),
+            (midi.SysexEvent.from_raw(0, [1, 2]), midi.SysexEvent(offset=0, data=[1, 2])),
+            (midi.TrackNameEvent.from_raw(0, [97, 98], 0x03), midi.TrackNameEvent(offset=0, data=[97, 98], metacommand=0x03)),
+            (midi.SetTempoEvent.from_raw(0, [7, 161, 32], 0x51), midi.SetTempoEvent(offset=0, data=[7, 161, 32])),
+            (midi.UnknownMetaEvent.from_raw(0, [1], 0x60), midi.UnknownMetaEvent(offset=0, data=[1], metacommand=0x60))
+        ]
+        for fast, slow in pairs:
+            self.assertEqual(repr(fast), repr(slow))
+            self.assertEqual(fast.metacommand if isinstance(fast, midi.MetaEvent) else None,
+                             slow.metacommand if isinstance(slow, midi.MetaEvent) else None)
+        self.assertEqual(pairs[3][0].text, "ab")
+
 
 class TestContainers(unittest.TestCase):
     def test_track_insert(self):
@@ -50,6 +89,22 @@ class TestContainers(unittest.TestCase):
         event=midi.AbstractEvent(offset=1); track.insert_event(event)
         self.assertEqual(track[3], event)
 
+    def test_track_mutation(self):
+        tempo=midi.SetTempoEvent(offset=0)
+        track=midi.Track([midi.AbstractEvent(offset=0)])
+        revision=track._tempo_revision
+        track.append(tempo)
+        self.assertEqual(track.events_of(midi.SetTempoEvent), [tempo])
+        for mutate in (lambda: track.remove(tempo), lambda: track.extend([tempo]), lambda: track.__delslice__(1, 2),
+                       lambda: track.insert(0, tempo), lambda: track.pop(0), lambda: track.__setitem__(0, tempo)):
+            mutate()
+            self.assertEqual(track.events_of(midi.SetTempoEvent), filter(lambda e: isinstance(e, midi.SetTempoEvent), track))
+            self.assertNotEqual(track._tempo_revision, revision)
+            revision=track._tempo_revision
+        clone=copy.copy(track)
+        self.assertTrue(clone._index is None)
+        self.assertEqual(clone.events_of(midi.SetTempoEvent), [tempo])
+
     def test_duration_without_duration(self):
         track=midi.Track()
         track.insert_event(midi.AbstractEvent(offset=0))
@@ -62,6 +117,121 @@ class TestContainers(unittest.TestCase):
         track.insert_event(midi.NoteOnEvent(offset=0, duration=11))
         self.assertEqual(track.duration, 11)
 
+    def test_duration_incremental(self):
+        track=midi.Track([midi.AbstractEvent(offset=0)])
+        self.assertEqual(track.duration, 0)
+        note=midi.NoteOnEvent(offset=5, duration=10)
+        track.append(note)
+        self.assertEqual(track._duration, 15)
+        track.insert_event(midi.AbstractEvent(offset=20))
+        self.assertEqual(track.duration, 20)
+        track.pop()
+        self.assertEqual(track.duration, 15)
+        note.duration=1
+        self.assertEqual(track.duration, 6)
+        pattern=midi.Pattern(tracks=[track])
+        note.duration+=10000
+        self.assertEqual(pattern.duration, 10006)
+        note.offset=100
+        self.assertEqual(pattern.duration, 10101)
+        self.assertEqual(len(track.events_in_range(10100, 10200)), 1)
+        # an event in several tracks reaches each of them
+        part=track[1:]
+        note.offset=200
+        self.assertListEqual([track.duration, part.duration], [10201, 10201])
+        # edits to events of other tracks or of no track leave the cached state of this one alone
+        self.assertEqual(len(track.events_in_range(10200, 10300)), 1)
+        ranges=track._ranges
+        other=midi.Track([midi.NoteOnEvent(offset=0, duration=10)])
+        other[0].duration=20
+        midi.NoteOnEvent(offset=5, duration=10).offset=10
+        self.assertTrue(ranges is not None and track._ranges is ranges)
+        self.assertEqual(track._duration, 10201)
+
+    def test_index(self):
+        name=midi.TrackNameEvent(offset=0, text="name")
+        track=midi.Track([midi.AbstractEvent(offset=0), midi.AbstractEvent(offset=10)])
+        self.assertEqual(track.get_text(name.metacommand), None)
+        track.insert_event(name, bias="left")
+        self.assertTrue(track.index.meta[name.metacommand][0] is name)
+        self.assertEqual(track.get_text(name.metacommand), "name")
+        tempos=[midi.SetTempoEvent(offset=offset) for offset in (20, 0, 10, 10)]
+        track.append(tempos[0])
+        track.insert_event(tempos[1], bias="left")
+        track.insert_event(tempos[2])
+        track.insert_event(tempos[3], bias="left")
+        self.assertListEqual(track.events_of(midi.SetTempoEvent), filter(lambda e: isinstance(e, midi.SetTempoEvent), track))
+        self.assertListEqual(track.index.meta[midi.SetTempoEvent.metacommand], track.events_of(midi.SetTempoEvent))
+        track.remove(name)
+        self.assertFalse(name.metacommand in track.index.meta)
+        self.assertEqual(track.index(tempos[1]), 0)
+        track.reverse()
+        self.assertListEqual(track.events_of(midi.SetTempoEvent), filter(lambda e: isinstance(e, midi.SetTempoEvent), track))
+
+    def test_index_call(self):
+        events=[midi.AbstractEvent(offset=offset) for offset in (0, 10, 20)]
+        track=midi.Track(events+[events[1]])
+        self.assertEqual(track.index(events[1]), list.index(track, events[1]))
+        self.assertEqual(track.index(events[1], 2), 3)
+        self.assertRaises(ValueError, track.index, events[1], 2, 3)
+        self.assertRaises(ValueError, track.index, midi.AbstractEvent(offset=30))
+        self.assertFalse(track.index.is_built())
+        track.append(midi.TrackNameEvent(offset=30, text="name"))
+        self.assertFalse(track.index.is_built())
+        self.assertEqual(track.get_text(midi.TrackNameEvent.metacommand), "name")
+        self.assertTrue(track.index.is_built())
+
+    def test_events_in_range(self):
+        rand=random.Random(1)
+        track=midi.Track()
+        for index in xrange(200):
+            track.insert_event(midi.NoteOnEvent(offset=rand.randint(0, 1000), pitch=60, duration=rand.choice([0, 5, 50, 400])))
+            if index%10==0:
+                track.insert_event(midi.ControlChangeEvent(offset=rand.randint(0, 1000)))
+        for start, end in [(0, 0), (0, 1001), (100, 200), (500, 510), (999, 2000), (300, 100)]:
+            for sounding in (True, False):
+                expected=[e for e in track if e.offset<end and (e.offset>=start or sounding and e.offset+getattr(e, "duration", 0)>start)
+                          and start<end]
+                self.assertListEqual(list(track.events_in_range(start, end, sounding)), expected)
+        long_note=midi.NoteOnEvent(offset=0, pitch=40, duration=600)
+        track.insert_event(long_note, bias="left")
+        self.assertTrue(track.events_in_range(550, 560)[0] is long_note)
+        self.assertFalse(long_note in list(track.events_in_range(550, 560, sounding=False)))
+
+    def test_track_view(self):
+        track=midi.Track([midi.NoteOnEvent(offset=offset, pitch=60, duration=10) for offset in xrange(0, 100, 10)])
+        view=track.view(2, 8)
+        self.assertEqual(len(view), 6)
+        self.assertListEqual([e.offset for e in view], [20, 30, 40, 50, 60, 70])
+        self.assertTrue(view[0] is track[2])
+        self.assertEqual(view[-1].offset, 70)
+        self.assertListEqual([e.offset for e in view[::-2]], [70, 50, 30])
+        self.assertListEqual([e.offset for e in track.view(step=-3)[1:]], [60, 30, 0])
+        self.assertEqual(view.duration, 80)
+        self.assertEqual(view.next_event(35).offset, 40)
+        self.assertEqual(view.next_event_index(100), -1)
+        self.assertRaises(IndexError, view.__getitem__, 6)
+        self.assertFalse(view.is_materialized())
+        view.append(midi.NoteOnEvent(offset=200, pitch=60))
+        self.assertTrue(view.is_materialized())
+        self.assertEqual(len(view), 7)
+        self.assertEqual(len(track), 10)
+        self.assertTrue(isinstance(view.events_of(midi.NoteOnEvent), list))
+        pattern=midi.Pattern(resolution=100, tracks=[track, track.view(0, 3).materialize(), track.view(0, 2).materialize()])
+        patview=pattern.view(1)
+        self.assertEqual(len(patview), 2)
+        self.assertEqual(patview.resolution, 100)
+        self.assertEqual(patview.duration, 30)
+        self.assertEqual(len(patview[1:]), 1)
+        self.assertEqual(patview[1:].resolution, 100)
+
+    def test_track_view_pages(self):
+        track=midi.Track([midi.AbstractEvent(offset=offset) for offset in xrange(10000)])
+        for start in (0, 5000, 9990):
+            self.assertListEqual(list(track.view(start, start+20)), list(track[start:start+20]))
+        self.assertListEqual(list(track.view(9999, 9000, -100)), list(track[9999:9000:-100]))
+        self.assertListEqual(list(track.view(9000, None, 300)[1:]), list(track[9300::300]))
+
 
 class TestPattern(unittest.TestCase):
     def test_construction(self):
@@ -88,6 +258,48 @@ class TestPattern(unittest.TestCase):
                 (33, 32), (15, 16), (4, 4), (3, 3), (1, 1), (0, 1))
         for v in values:
             self.assertEqual(pattern.nearest_quantized_duration(v[0]), v[1])
+            self.assertEqual(pattern.nearest_quantized_duration(v[0]), v[1])
+
+    def test_window(self):
+        pattern=midi.read_midifile("./data/tempo.mid")
+        window=pattern.window(500, 1000)
+        self.assertEqual(window.resolution, pattern.resolution)
+        self.assertEqual(len(window), len(pattern))
+        self.assertListEqual([(e.offset, e.pitch) for e in window[0] if isinstance(e, midi.NoteOnEvent)], [(480, 62), (960, 64)])
+
+    def test_clone(self):
+        pattern=midi.read_midifile("./data/tempo.mid")
+        pattern[0].append(midi.UnknownMetaEvent(offset=5000, data=[1], metacommand=0x60))
+        clone=pattern.clone()
+        self.assertEqual(repr(clone), repr(pattern))
+        self.assertEqual(repr(copy.deepcopy(pattern)), repr(pattern))
+        self.assertEqual(clone.duration, pattern.duration)
+        self.assertFalse(any(a is b or a.data is b.data for a, b in zip(clone[0], pattern[0])))
+        self.assertEqual(clone[0][-1].metacommand, 0x60)
+
+    def test_merge_tracks(self):
+        tracks=[midi.Track([midi.ControlChangeEvent(offset=offset, channel=index, value=position)
+                            for position, offset in enumerate(offsets)])
+                for index, offsets in enumerate([(0, 10, 10, 30), (10, 20), (), (0, 30)])]
+        pattern=midi.Pattern(resolution=96, tracks=tracks)
+        merged=pattern.merge_tracks()
+        self.assertListEqual([(e.offset, e.channel, e.value) for e in merged],
+                             [(0, 0, 0), (0, 3, 0), (10, 0, 1), (10, 0, 2), (10, 1, 0), (20, 1, 1), (30, 0, 3), (30, 3, 1)])
+        self.assertTrue(merged[0] is tracks[0][0])
+        format0=pattern.to_format0()
+        self.assertEqual((format0.format, format0.resolution, len(format0)), (0, 96, 1))
+        self.assertEqual(len(format0[0]), 8)
+
+    def test_rescale(self):
+        pattern=midi.read_midifile("./data/tempo.mid")
+        original=repr(pattern)
+        converter=pattern.get_tick_converter()
+        seconds=[converter.offset_to_seconds(e.offset) for e in pattern[0]]
+        self.assertTrue(pattern.rescale(pattern.resolution*3) is pattern)
+        self.assertEqual(pattern.resolution, 1440)
+        self.assertListEqual([pattern.get_tick_converter().offset_to_seconds(e.offset) for e in pattern[0]], seconds)
+        pattern.rescale(480)
+        self.assertEqual(repr(pattern), original)
 
     def test_next_event(self):
         track=midi.Track([
@@ -123,6 +335,54 @@ class TestTickConverter(unittest.TestCase):
         self.assertAlmostEqual(self.converter.offset_to_seconds(480*16), 60/30*4+60/60*4+60/90*4+60/120*4, places=5)
         self.assertAlmostEqual(self.converter.offset_to_seconds(480*10), 60/30*4+60/60*4+60/90*2, places=5)
 
+    def test_offsets_to_seconds(self):
+        offsets=[480*16, 0, 480*4, 480*10, 480*8, 480*10+7]
+        seconds=self.converter.offsets_to_seconds(offsets)
+        self.assertListEqual(list(seconds), [self.converter.offset_to_seconds(o) for o in offsets])
+        self.assertListEqual(list(self.converter.offsets_to_seconds(sorted(offsets))), sorted(seconds))
+        self.assertListEqual(list(self.converter.seconds_to_offsets(seconds)), offsets)
+        self.assertEqual(self.converter.seconds_to_offset(60/30*4+60/60*2), 480*6)
+
+    def test_default_tempo(self):
+        # 120 bpm applies before the first tempo, so a tick is 1/960 seconds at resolution 480
+        tempo=midi.SetTempoEvent(offset=480)
+        tempo.bpm=60
+        for tracks in ([midi.Track([tempo])], [midi.Track()], []):
+            converter=midi.Pattern(resolution=480, tracks=tracks).get_tick_converter()
+            self.assertEqual(converter.offset_to_seconds(0), 0)
+            self.assertEqual(converter.offset_to_seconds(240), 0.25)
+            self.assertListEqual(list(converter.offsets_to_seconds([240, 0])), [0.25, 0])
+            self.assertEqual(converter.seconds_to_offset(0.25), 240)
+            self.assertListEqual(list(converter.seconds_to_offsets([0.25, 0])), [240, 0])
+        self.assertEqual(converter.offset_to_seconds(480*2), 1)
+        self.assertEqual(midi.Pattern(resolution=480, tracks=[midi.Track([tempo])]).get_tick_converter().offset_to_seconds(480*2), 1.5)
+
+    def test_events_to_seconds(self):
+        track=midi.Track([midi.NoteOnEvent(offset=0, duration=480*4), midi.AbstractEvent(offset=480*4)])
+        offsets, durations=self.converter.events_to_seconds(track)
+        self.assertListEqual(list(offsets), [0, 60/30*4])
+        self.assertListEqual(list(durations), [60/30*4, 0])
+
+    def test_cache(self):
+        self.assertTrue(self.pattern.get_tick_converter() is self.converter)
+        track=self.pattern[0]
+        tempo=midi.SetTempoEvent(offset=480*16)
+        tempo.bpm=240
+        track.insert_event(tempo)
+        converter=self.pattern.get_tick_converter()
+        self.assertFalse(converter is self.converter)
+        self.assertAlmostEqual(converter.offset_to_seconds(480*17), 60/30*4+60/60*4+60/90*4+60/120*4+60/240, places=5)
+        self.assertTrue(self.pattern.get_tick_converter() is converter)
+        tempo.bpm=60
+        converter=self.pattern.get_tick_converter()
+        self.assertAlmostEqual(converter.offset_to_seconds(480*17), 60/30*4+60/60*4+60/90*4+60/120*4+60/60, places=5)
+        del track[track.index(tempo)]
+        self.assertAlmostEqual(self.pattern.get_tick_converter().offset_to_seconds(480*17), 60/30*4+60/60*4+60/90*4+60/120*5, places=5)
+        self.pattern.append(midi.Track([tempo]))
+        self.assertAlmostEqual(self.pattern.get_tick_converter().offset_to_seconds(480*17), 60/30*4+60/60*4+60/90*4+60/120*4+60/60, places=5)
+        self.assertTrue(copy.copy(self.pattern)._tempo_cache is None)
+        self.assertEqual(repr(copy.copy(self.pattern)), repr(self.pattern))
+
     def test_duration_to_seconds(self):
         self.assertEqual(self.converter.duration_to_seconds(0, 0), 0)
         self.assertEqual(self.converter.duration_to_seconds(0, 480*4), 60/30*4)
@@ -140,6 +400,174 @@ class TestIO(unittest.TestCase):
         self.assertEqual(len(filter(lambda e: isinstance(e, midi.NoteOffEvent), self.pattern[0])), 0)
         self.assertEqual(len(filter(lambda e: isinstance(e, midi.NoteOnEvent), self.pattern[0])), 4)
 
+    def test_engines(self):
+        for path in ("./data/overlap.mid", "./data/tempo.mid"):
+            with warnings.catch_warnings(record=True) as caught1:
+                warnings.simplefilter("always")
+                pattern1=midi.read_midifile(path, engine="iterator")
+            with warnings.catch_warnings(record=True) as caught2:
+                warnings.simplefilter("always")
+                pattern2=midi.read_midifile(path, engine="buffer")
+            self.assertEqual(repr(pattern1), repr(pattern2))
+            self.assertListEqual([str(w.message) for w in caught1], [str(w.message) for w in caught2])
+
+    def test_truncated_track(self):
+        reader=midi.FileReader()
+        events=list(reader.iter_track_data("\x00\x90\x3c\x40\x10\x3c"))
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0].pitch, 0x3c)
+        self.assertRaises(ValueError, midi.FileReader, "bogus")
+
+    def test_note_pairing(self):
+        # two overlapped C4s on channel 0 and one on channel 1
+        trackdata="\x00\x90\x3c\x40" "\x0a\x3c\x40" "\x00\x91\x3c\x40" "\x0a\x80\x3c\x00" "\x0a\x3c\x00" "\x0a\x81\x3c\x00"
+        def _read(policy):
+            reader=midi.FileReader(note_policy=policy)
+            track=midi.Track()
+            reader.parse_track(StringIO("MTrk" + struct.pack(">L", len(trackdata)) + trackdata), track)
+            return [(e.channel, e.duration) for e in track]
+        self.assertListEqual(_read("fifo"), [(0, 20), (0, 20), (1, 30)])
+        self.assertListEqual(_read("lifo"), [(0, 30), (0, 10), (1, 30)])
+        self.assertListEqual(_read({0: "lifo"}), [(0, 30), (0, 10), (1, 30)])
+        self.assertRaises(ValueError, midi.FileReader, note_policy="bogus")
+
+    def test_unresolved_notes(self):
+        trackdata="\x00\x90\x3c\x40" "\x00\x90\x3e\x40" "\x0a\x80\x3e\x00"
+        track=midi.Track()
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            midi.FileReader().parse_track(StringIO("MTrk" + struct.pack(">L", len(trackdata)) + trackdata), track)
+        self.assertEqual(len(track), 1)
+        self.assertEqual(track[0].pitch, 0x3e)
+        self.assertListEqual([str(w.message) for w in caught], ["unresolved note: 60 at 0"])
+
+    def test_parse_stats(self):
+        # running status note-on, errant note-off, unknown meta event and a hanging note
+        trackdata="\x00\x90\x3c\x40" "\x0a\x3c\x00" "\x00\x80\x3e\x00" "\x00\xff\x60\x01\x00" "\x00\x90\x40\x40"
+        chunk="MTrk" + struct.pack(">L", len(trackdata)) + trackdata
+        results=[]
+        with warnings.catch_warnings(record=True):
+            warnings.simplefilter("always")
+            for engine in midi.FileReader.ENGINES:
+                stats=midi.ParseStats()
+                midi.FileReader(engine, stats=stats).parse_track(StringIO(chunk), midi.Track())
+                results.append(stats)
+            stats=midi.ParseStats()
+            midi.FileReader(stats=stats).parse_track_table(trackdata, midi.NoteTable())
+            results.append(stats)
+        for stats in results:
+            self.assertEqual(stats.bytes_read, len(trackdata))
+            self.assertEqual(stats.running_status_hits, 1)
+            self.assertEqual(stats.errant_note_offs, 1)
+            self.assertEqual(stats.unresolved_notes, 1)
+            self.assertDictEqual(stats.unknown_meta_events, {0x60: 1})
+            self.assertEqual(stats.events["NoteOnEvent"], 2)
+            self.assertEqual(stats.events["NoteOffEvent"], 2)
+            self.assertEqual(len(stats.track_seconds), 1)
+
+    def test_parse_stats_disabled(self):
+        reader=midi.FileReader()
+        self.assertTrue(reader.stats is None)
+        self.assertFalse("parse_midi_event_at" in vars(reader))
+        stats=midi.ParseStats()
+        pattern=midi.read_midifile("./data/tempo.mid", stats=stats)
+        paired=sum(stats.events.itervalues())-stats.events.get("NoteOffEvent", 0)-stats.events["EndOfTrackEvent"]
+        self.assertEqual(paired, sum(len(track) for track in pattern))
+        self.assertEqual(len(stats.track_seconds), len(pattern))
+
+    def test_interned(self):
+        trackdata="\x00\xb0\x07\x64" "\x0a\x07\x64" "\x0a\xe0\x00\x40" "\x0a\xb0\x07\x64"
+        for engine in midi.FileReader.ENGINES:
+            track=midi.Track()
+            midi.FileReader(engine, interned=True).parse_track(StringIO("MTrk" + struct.pack(">L", len(trackdata)) + trackdata), track)
+            self.assertListEqual([e.data for e in track], [(7, 100), (7, 100), (0, 64), (7, 100)])
+            self.assertTrue(track[0].data is track[1].data is track[3].data)
+            track[1].value=50
+            self.assertListEqual(track[1].data, [7, 50])
+            self.assertEqual(track[0].value, 100)
+            track[2].pitch=0
+            self.assertListEqual(track[2].data, [0, 64])
+        pattern=midi.read_midifile("./data/tempo.mid")
+        interned=midi.read_midifile("./data/tempo.mid", interned=True)
+        for track, track_interned in zip(pattern, interned):
+            self.assertListEqual([(e.offset, e.data) for e in track], [(e.offset, list(e.data)) for e in track_interned])
+        written, written_interned=StringIO(), StringIO()
+        midi.write_midifile(written, pattern)
+        midi.write_midifile(written_interned, interned)
+        self.assertEqual(written.getvalue(), written_interned.getvalue())
+        packed=midi.unpack_pattern(midi.pack_pattern(pattern), interned=True)
+        self.assertTrue(all(type(event.data) is tuple for track in packed for event in track))
+
+    def test_iter_midifile(self):
+        for path in ("./data/overlap.mid", "./data/tempo.mid"):
+            pattern=midi.read_midifile(path)
+            streamed=midi.Pattern(resolution=pattern.resolution, format=pattern.format, tracks=[midi.Track() for track in pattern])
+            for index, event in midi.iter_midifile(path):
+                streamed[index].append(event)
+            self.assertEqual(repr(pattern), repr(streamed))
+        raw=[event for index, event in midi.iter_midifile("./data/overlap.mid", raw=True)]
+        self.assertEqual(len(filter(lambda e: isinstance(e, midi.NoteOnEvent), raw)), 4)
+        self.assertEqual(len(filter(lambda e: isinstance(e, midi.NoteOffEvent), raw)), 4)
+        self.assertTrue(isinstance(raw[-1], midi.EndOfTrackEvent))
+
+    def test_iter_midifile_reads_incrementally(self):
+        class _Counting(object):
+            def __init__(self, data):
+                self.data=StringIO(data)
+                self.read_bytes=0
+            def read(self, size=-1):
+                chunk=self.data.read(size)
+                self.read_bytes+=len(chunk)
+                return chunk
+        events=[midi.ControlChangeEvent(offset=offset, value=1) for offset in xrange(5000)]
+        events.insert(2500, midi.SetTempoEvent(offset=2500, bpm=90))
+        track=midi.Track(events)
+        written=StringIO()
+        midi.write_midifile(written, midi.Pattern(format=0, tracks=[track]))
+        data=written.getvalue()
+        expected=[repr(event) for event in midi.read_midifile(StringIO(data))[0]]
+        for engine in midi.FileReader.ENGINES:
+            midifile=_Counting(data)
+            events=midi.iter_midifile(midifile, raw=True, engine=engine)
+            next(events)
+            # the file header, the track header and one window of the track chunk
+            self.assertEqual(midifile.read_bytes, 14+8+midi.FileReader.STREAM_WINDOW)
+            self.assertListEqual([repr(event) for index, event in events
+                                  if not isinstance(event, midi.EndOfTrackEvent)], expected[1:])
+            self.assertEqual(midifile.read_bytes, len(data))
+
+    def test_pair_notes(self):
+        trackdata="\x00\x90\x3c\x40" "\x00\x90\x3e\x40" "\x00\xb0\x07\x64" "\x0a\x80\x3e\x00" "\x0a\x80\x3c\x00"
+        reader=midi.FileReader()
+        events=list(reader.pair_notes(reader.iter_track_data(trackdata)))
+        self.assertListEqual([e.__class__ for e in events], [midi.NoteOnEvent, midi.NoteOnEvent, midi.ControlChangeEvent])
+        self.assertListEqual([e.duration for e in events[:2]], [20, 10])
+
+    def test_lazy(self):
+        pattern=midi.read_midifile("./data/tempo.mid")
+        lazy=midi.read_midifile("./data/tempo.mid", lazy=True)
+        self.assertTrue(isinstance(lazy, midi.LazyPattern))
+        self.assertEqual(len(lazy), len(pattern))
+        self.assertFalse(lazy.is_decoded(0))
+        self.assertEqual(repr(lazy[0]), repr(pattern[0]))
+        self.assertTrue(lazy.is_decoded(0))
+        self.assertTrue(lazy[0] is lazy[0])
+        self.assertEqual(repr(lazy), repr(pattern))
+        self.assertEqual(lazy.get_tick_converter().offset_to_seconds(480*4), 60/30*4)
+        released=weakref.ref(lazy[0])
+        lazy.release()
+        self.assertFalse(lazy.is_decoded(0))
+        gc.collect()
+        self.assertTrue(released() is None)
+        self.assertEqual(lazy.get_tick_converter().offset_to_seconds(480*4), 60/30*4)
+        self.assertEqual(len(copy.copy(lazy)), len(lazy))
+        lazy.close()
+        with open("./data/overlap.mid", "rb") as f:
+            lazy=midi.read_midifile(StringIO(f.read()), lazy=True)
+        lazy.max_decoded=1
+        self.assertEqual(len(lazy[0]), 10)
+        self.assertEqual(repr(lazy[:]), repr(midi.read_midifile("./data/overlap.mid")))
+
     def test_track_text(self):
         self.assertEqual(self.pattern[0].get_text(midi.TrackNameEvent.metacommand), "Classic Electric Piano")
         self.assertEqual(self.pattern[0].get_text(midi.InstrumentNameEvent.metacommand), "curt")
@@ -158,6 +586,342 @@ class TestIO(unittest.TestCase):
                 event2=pattern2[track_idx][event_idx]
                 self.assertEqual(event1.data, event2.data)
 
+    def test_write_engines(self):
+        track=midi.Track([
+            midi.NoteOnEvent(offset=0, pitch=60, velocity=1, duration=10),
+            midi.NoteOnEvent(offset=0, pitch=62, velocity=2, duration=10),
+            midi.NoteOnEvent(offset=5, pitch=64, velocity=3, duration=0),
+            midi.NoteOnEvent(offset=10, channel=1, pitch=60, velocity=4, duration=20),
+            midi.ControlChangeEvent(offset=10, control=7, value=100)
+        ])
+        for pattern in (self.pattern, midi.Pattern(tracks=[track, midi.Track()])):
+            buf1, buf2=StringIO(), StringIO()
+            midi.write_midifile(buf1, pattern, engine="insert")
+            midi.write_midifile(buf2, pattern, engine="merge")
+            self.assertEqual(buf1.getvalue(), buf2.getvalue())
+
+    def test_encode_events(self):
+        events=[midi.TrackNameEvent(offset=0, text="name"),
+                midi.NoteOnEvent(offset=0, channel=1, pitch=60, velocity=100),
+                midi.NoteOnEvent(offset=10, channel=1, pitch=64, velocity=100),
+                midi.NoteOnEvent(offset=10, channel=2, pitch=64, velocity=100),
+                midi.SysexEvent(offset=200, data=[0x7E, 0x7F, 0x09, 0x01]),
+                midi.NoteOffEvent(offset=20000, channel=2, pitch=64),
+                midi.ProgramChangeEvent(offset=5000000, channel=2, value=3),
+                midi.EndOfTrackEvent(offset=5000000)]
+        writer=midi.FileWriter()
+        expected=[]
+        offset=0
+        for event in events:
+            expected.append(writer.encode_midi_event(event, event.offset-offset))
+            offset=event.offset
+        running=writer.RunningStatus
+        writer.RunningStatus=None
+        buf=bytearray()
+        self.assertEqual(writer.encode_events(events, buf), 5000000)
+        self.assertEqual(str(buf), ''.join(expected))
+        self.assertIs(writer.RunningStatus, running)
+
+    def test_stream_writer(self):
+        pattern=midi.read_midifile("./data/overlap.mid")
+        pattern.append(midi.Track([midi.ControlChangeEvent(offset=offset, channel=1, value=offset) for offset in xrange(10)]))
+        written=StringIO()
+        midi.write_midifile(written, pattern)
+        streamed=StringIO()
+        with midi.StreamWriter(streamed, resolution=pattern.resolution, format=pattern.format) as writer:
+            for track in pattern:
+                writer.start_track()
+                writer.add_events(track)
+            self.assertRaises(ValueError, writer.add_event, midi.ControlChangeEvent(offset=0))
+        self.assertEqual(writer.tracks, 2)
+        self.assertEqual(streamed.getvalue(), written.getvalue())
+        self.assertEqual(repr(midi.read_midifile(StringIO(streamed.getvalue()))), repr(pattern))
+
+
+class TestTables(unittest.TestCase):
+    def test_round_trip(self):
+        track=midi.read_midifile("./data/overlap.mid")[0]
+        table=midi.NoteTable.from_track(track)
+        self.assertEqual(len(table), 4)
+        self.assertEqual(len(table.events), 6)
+        self.assertListEqual(list(table.durations), [600, 600, 320, 240])
+        self.assertEqual(table.duration, track.duration)
+        self.assertEqual(repr(table.to_track()), repr(track))
+
+    def test_round_trip_order(self):
+        track=midi.Track([midi.NoteOnEvent(offset=0, pitch=60, velocity=64, duration=10),
+                          midi.ControlChangeEvent(offset=0, control=7, value=100),
+                          midi.NoteOnEvent(offset=0, pitch=62, velocity=64, duration=10),
+                          midi.NoteOnEvent(offset=10, pitch=64, velocity=64, duration=10),
+                          midi.MarkerEvent(offset=10, text="verse"),
+                          midi.ProgramChangeEvent(offset=20, value=3)])
+        table=midi.NoteTable.from_track(track)
+        self.assertListEqual(list(table.event_rows), [1, 3, 3])
+        self.assertEqual(repr(table.to_track()), repr(track))
+        table.compact([0])
+        self.assertListEqual(list(table.event_rows), [0, 2, 2])
+        self.assertEqual(repr(table.to_track()), repr(midi.Track(track[1:])))
+
+    def test_read(self):
+        for path in ("./data/overlap.mid", "./data/tempo.mid"):
+            pattern=midi.read_midifile(path)
+            tables=midi.read_note_tables(path)
+            self.assertEqual(pattern.resolution, tables.resolution)
+            for track, table in zip(pattern, tables):
+                self.assertEqual(repr(midi.NoteTable.from_track(track).to_track()), repr(table.to_track()))
+                self.assertEqual(repr(table.to_track()), repr(track))
+
+    def test_tick_converter(self):
+        tables=midi.read_note_tables("./data/tempo.mid")
+        converter=tables.get_tick_converter()
+        self.assertEqual(converter.offset_to_seconds(480*4), 60/30*4)
+        self.assertTrue(tables.get_tick_converter() is converter)
+        tables[0].events.append(midi.SetTempoEvent(offset=480*16, bpm=60))
+        self.assertFalse(tables.get_tick_converter() is converter)
+
+    def test_unresolved(self):
+        trackdata="\x00\x90\x3c\x40" "\x00\x90\x3e\x40" "\x0a\x3e\x00" "\x00\x81\x3e\x00"
+        table=midi.NoteTable()
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            midi.FileReader().parse_track_table(trackdata, table)
+        self.assertListEqual(list(table.pitches), [0x3e])
+        self.assertListEqual(list(table.durations), [10])
+        self.assertListEqual([str(w.message) for w in caught], ["errant note off: 62", "unresolved note: 60 at 0"])
+
+
+class TestParallel(unittest.TestCase):
+    def test_pack(self):
+        pattern=midi.read_midifile("./data/overlap.mid")
+        pattern[0].append(midi.SysexEvent(offset=3000, data=[1, 2]))
+        pattern[0].append(midi.UnknownMetaEvent(offset=3000, metacommand=0x70, data=[3]))
+        self.assertEqual(repr(midi.unpack_pattern(midi.pack_pattern(pattern))), repr(pattern))
+
+    def test_read_midifiles(self):
+        paths=["./data/overlap.mid", "./data/missing.mid", "./data/tempo.mid"]
+        for workers in (1, 2):
+            results=midi.read_midifiles(paths, workers=workers)
+            self.assertListEqual([result.path for result in results], paths)
+            self.assertEqual(repr(results[0].pattern), repr(midi.read_midifile(paths[0])))
+            self.assertEqual(repr(results[2].pattern), repr(midi.read_midifile(paths[2])))
+            self.assertTrue(results[1].pattern is None)
+            self.assertTrue(results[1].error.startswith("IOError"))
+
+    def test_read_midifiles_stats(self):
+        paths=["./data/overlap.mid", "./data/tempo.mid"]
+        for workers in (1, 2):
+            for result in midi.read_midifiles(paths, workers=workers, stats=True):
+                self.assertTrue(result.stats.bytes_read > 0)
+        self.assertTrue(midi.read_midifiles(paths, workers=1)[0].stats is None)
+
+    def test_read_parallel(self):
+        for path in ("./data/overlap.mid", "./data/tempo.mid"):
+            self.assertEqual(repr(midi.read_midifile(path, workers=2)), repr(midi.read_midifile(path)))
+        trackdata="\x00\x90\x3c\x40"
+        data="MThd" + struct.pack(">LHHH", 6, 1, 2, 96) + ("MTrk" + struct.pack(">L", len(trackdata)) + trackdata)*2
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            pattern=midi.read_midifile(StringIO(data), workers=2)
+        self.assertListEqual([len(track) for track in pattern], [0, 0])
+        self.assertListEqual([str(w.message) for w in caught], ["unresolved note: 60 at 0"]*2)
+        trackdata="\x00\xb0\x07\x64"
+        data="MThd" + struct.pack(">LHHH", 6, 1, 2, 96) + ("MTrk" + struct.pack(">L", len(trackdata)) + trackdata)*2
+        pattern=midi.read_midifile(StringIO(data), workers=2, interned=True)
+        self.assertTrue(pattern[0][0].data is pattern[1][0].data)
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.directory=tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_save_load(self):
+        pattern=midi.read_midifile("./data/overlap.mid")
+        pattern.append(midi.Track([midi.SysexEvent(offset=1, data=[1, 2, 3]), midi.ControlChangeEvent(offset=2, channel=3, control=7, value=9)]))
+        path=os.path.join(self.directory, "overlap.mpyc")
+        midi.save_cache(pattern, path)
+        self.assertEqual(repr(midi.load_cache(path)), repr(pattern))
+        with open(path, "r+b") as cachefile:
+            cachefile.write("XXXX")
+        self.assertRaises(TypeError, midi.load_cache, path)
+
+    def test_cache_dir(self):
+        pattern=midi.read_midifile("./data/tempo.mid", cache_dir=self.directory)
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+        self.assertEqual(repr(midi.read_midifile("./data/tempo.mid", cache_dir=self.directory)), repr(pattern))
+        midi.read_midifile("./data/tempo.mid", note_policy="lifo", cache_dir=self.directory)
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+
+    def test_cache_dir_damaged(self):
+        pattern=midi.read_midifile("./data/tempo.mid", cache_dir=self.directory)
+        path=os.path.join(self.directory, os.listdir(self.directory)[0])
+        with open(path, "rb") as cachefile:
+            blob=cachefile.read()
+        count, size, position=struct.unpack_from("<IIQ", blob, 16)
+        # the statuses column follows the offsets, durations and sizes columns of 4 bytes each
+        status=position+12*count
+        damaged=[blob[:10], blob[:40], blob[:len(blob)//2], blob[:status+count+size-1], blob[:status]+"\x01"+blob[status+1:]]
+        for data in damaged:
+            with open(path, "wb") as cachefile:
+                cachefile.write(data)
+            self.assertRaises(midi.CacheError, midi.load_cache, path)
+            self.assertEqual(repr(midi.read_midifile("./data/tempo.mid", cache_dir=self.directory)), repr(pattern))
+            self.assertEqual(repr(midi.load_cache(path)), repr(pattern))
+
+
+class TestTransforms(unittest.TestCase):
+    def pipeline(self):
+        return midi.Pipeline(midi.Transpose(3), midi.Velocity(factor=2)).then(midi.Rescale(960)).then(midi.Quantize(grid=240))
+
+    def test_track(self):
+        pattern=midi.read_midifile("./data/tempo.mid")
+        notes=[(e.offset, e.pitch, e.velocity, e.duration) for e in pattern[0] if isinstance(e, midi.NoteOnEvent)]
+        self.pipeline().apply_pattern(pattern)
+        self.assertEqual(pattern.resolution, 960)
+        result=[(e.offset, e.pitch, e.velocity, e.duration) for e in pattern[0] if isinstance(e, midi.NoteOnEvent)]
+        expected=[((offset*2+120)//240*240, pitch+3, min(velocity*2, 127), midi.nearest_quantized_duration(960, duration*2))
+                  for offset, pitch, velocity, duration in notes]
+        self.assertListEqual(result, expected)
+        self.assertEqual(pattern[0].duration, max(offset+duration for offset, pitch, velocity, duration in expected))
+
+    def test_columns(self):
+        pattern=midi.read_midifile("./data/tempo.mid")
+        tables=midi.read_note_tables("./data/tempo.mid")
+        self.pipeline().apply_pattern(pattern)
+        self.pipeline().apply_pattern(tables)
+        self.assertEqual(tables.resolution, 960)
+        self.assertEqual(repr(tables[0].to_track()), repr(pattern[0]))
+        self.assertRaises(ValueError, midi.Pipeline(midi.Rescale(96)).apply_track, midi.Track())
+
+    def test_stretch_ends(self):
+        # abutting notes keep abutting when offsets and durations round in different directions
+        track=midi.Track([midi.NoteOnEvent(offset=0, duration=5), midi.NoteOnEvent(offset=5, duration=5)])
+        midi.Pipeline(midi.Stretch(1, 3)).apply_track(track)
+        self.assertEqual(track[0].offset+track[0].duration, track[1].offset)
+        self.assertEqual(track[1].offset+track[1].duration, 3)
+        track=midi.Track([midi.NoteOnEvent(offset=0, duration=2), midi.NoteOnEvent(offset=2, duration=2)])
+        midi.Pipeline(midi.Rescale(2)).apply_track(track, 3)
+        self.assertEqual(track[0].offset+track[0].duration, track[1].offset)
+        self.assertEqual(track.duration, 3)
+
+    def test_copy(self):
+        for read in (midi.read_midifile, midi.read_note_tables):
+            pattern=read("./data/tempo.mid")
+            original=repr([list(track) for track in pattern])
+            clone=self.pipeline().apply_pattern(pattern, copy=True)
+            self.assertEqual(repr([list(track) for track in pattern]), original)
+            self.assertEqual((pattern.resolution, clone.resolution), (480, 960))
+            edited=self.pipeline().apply_pattern(read("./data/tempo.mid"))
+            self.assertEqual(repr([list(track) for track in clone]), repr([list(track) for track in edited]))
+        self.assertFalse(any(a is b for a, b in zip(clone[0].events, pattern[0].events)))
+
+
+class TestSequencer(unittest.TestCase):
+    def setUp(self):
+        # 120 bpm at resolution 100, so one tick is 5ms
+        tempo=midi.SetTempoEvent(offset=0)
+        tempo.bpm=120
+        self.pattern=midi.Pattern(resolution=100, tracks=[
+            midi.Track([tempo, midi.NoteOnEvent(offset=0, pitch=60, velocity=90, duration=100),
+                        midi.NoteOnEvent(offset=100, pitch=62, velocity=90, duration=150)]),
+            midi.Track([midi.ControlChangeEvent(offset=100, channel=1, control=7, value=100),
+                        midi.NoteOnEvent(offset=200, channel=1, pitch=40, velocity=90, duration=100)])])
+        self.clock=midi.FakeClock()
+        self.sink=midi.FakeSink()
+        self.sequencer=midi.Sequencer(self.pattern, self.sink, clock=self.clock.time, sleep=self.clock.sleep)
+
+    def sent(self):
+        return [(round(due, 6), track, event.__class__.__name__, event.offset) for due, track, event in self.sink.sent]
+
+    def test_merge_playback(self):
+        merged=[(offset, track, event.__class__) for offset, track, event in midi.merge_playback(self.pattern)]
+        self.assertListEqual(merged, [
+            (0, 0, midi.SetTempoEvent), (0, 0, midi.NoteOnEvent), (100, 0, midi.NoteOffEvent), (100, 0, midi.NoteOnEvent),
+            (100, 1, midi.ControlChangeEvent), (200, 1, midi.NoteOnEvent), (250, 0, midi.NoteOffEvent), (300, 1, midi.NoteOffEvent)])
+
+    def test_play(self):
+        self.clock.latency=0.002
+        self.sequencer.play()
+        self.assertListEqual([due for due, track, name, offset in self.sent()], [0, 0, 0.5, 0.5, 0.5, 1.0, 1.25, 1.5])
+        self.assertEqual(self.sequencer.stats.events, 8)
+        self.assertEqual(self.sequencer.stats.late_events, 0)
+        self.assertAlmostEqual(self.sequencer.stats.max_lateness, 0.002)
+        self.assertAlmostEqual(self.clock.now, 1.502)
+        self.assertFalse(self.sequencer.is_playing())
+
+    def test_play_tables(self):
+        self.sequencer.play()
+        tables=midi.Pattern(resolution=100, tracks=[midi.NoteTable.from_track(track) for track in self.pattern])
+        clock, sink=midi.FakeClock(), midi.FakeSink()
+        midi.Sequencer(tables, sink, clock=clock.time, sleep=clock.sleep).play()
+        self.assertListEqual([(due, track, repr(event)) for due, track, event in sink.sent],
+                             [(due, track, repr(event)) for due, track, event in self.sink.sent])
+
+    def test_tempo_scale(self):
+        self.sequencer.tempo_scale=2
+        self.sequencer.play()
+        self.assertAlmostEqual(self.clock.now, 0.75)
+        self.assertRaises(ValueError, setattr, self.sequencer, "tempo_scale", 0)
+
+    def test_seek_and_loop(self):
+        self.sequencer.seek(100)
+        self.sequencer.set_loop(100, 200, count=1)
+        self.sequencer.play()
+        # the note-off at 100 belongs to a note that was never played. The note sounding at the loop end is
+        # silenced on each jump back.
+        self.assertListEqual(self.sent(), [
+            (0, 0, "NoteOnEvent", 100), (0, 1, "ControlChangeEvent", 100), (0.5, 0, "NoteOffEvent", 200),
+            (0.5, 0, "NoteOnEvent", 100), (0.5, 1, "ControlChangeEvent", 100),
+            (1.0, 1, "NoteOnEvent", 200), (1.25, 0, "NoteOffEvent", 250), (1.5, 1, "NoteOffEvent", 300)])
+
+    def test_stop(self):
+        sequencer=self.sequencer
+        class StoppingSink(midi.FakeSink):
+            def send(self, event, track, due):
+                super(StoppingSink, self).send(event, track, due)
+                if isinstance(event, midi.ControlChangeEvent):
+                    sequencer.stop()
+        sequencer.sink=StoppingSink()
+        sequencer.play()
+        self.assertListEqual([event.__class__ for due, track, event in sequencer.sink.sent][-2:],
+                             [midi.ControlChangeEvent, midi.NoteOffEvent])
+        self.assertEqual(sequencer.position, 100)
+        sequencer.play()
+        self.assertEqual(sequencer.sink.sent[-1][2].offset, 300)
+
+    def test_play_async(self):
+        clock=self.clock
+        class FakeLoop(object):
+            def __init__(self):
+                self.calls=[]
+            def time(self):
+                return clock.now
+            def call_at(self, when, callback):
+                return self.call_soon(callback, when)
+            def call_soon(self, callback, when=None):
+                call=[when if when is not None else clock.now, callback, False]
+                self.calls.append(call)
+                return type("Handle", (object,), {"cancel": lambda self: call.__setitem__(2, True)})()
+            def create_future(self):
+                future=type("Future", (object,), {})()
+                future.set_result=lambda result: setattr(future, "result", result)
+                return future
+            def run(self):
+                while self.calls:
+                    self.calls.sort(key=lambda call: call[0])
+                    when, callback, cancelled=self.calls.pop(0)
+                    if not cancelled:
+                        clock.now=max(clock.now, when)
+                        callback()
+        loop=FakeLoop()
+        future=self.sequencer.play_async(loop)
+        loop.run()
+        self.assertTrue(future.result is self.sequencer.stats)
+        self.assertEqual(len(self.sink.sent), 8)
+        self.assertAlmostEqual(clock.now, 1.5)
+
 
 if __name__ == '__main__':
     unittest.main()